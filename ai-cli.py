@@ -1,18 +1,23 @@
 #!/usr/bin/env python
 import argparse
+import atexit
 import json
 import os
 import sys
+import threading
 import time
 from enum import auto
 from enum import Enum
 from typing import Optional
 
 import ai
+import metrics
 import models as models_loader
 
 enable_color = False
-output_buffer = []
+session_journal = None
+cleanups = []
+models_state = None
 
 
 class OutputType(Enum):
@@ -23,56 +28,59 @@ class OutputType(Enum):
     Error = auto()
 
 
-def get_cache_dir() -> Optional[str]:
-    if os.getenv("XDG_CACHE_HOME") is not None:
-        return os.getenv("XDG_CACHE_HOME", "") + "/ai-cli"
-    elif os.getenv("HOME") is not None:
-        return os.getenv("HOME", "") + "/.cache/ai-cli"
-    elif os.getenv("TMP") is not None:
-        return os.getenv("TMP", "") + "/ai-cli"
-    elif os.getenv("TEMP") is not None:
-        return os.getenv("TEMP", "") + "/ai-cli"
-    return None
+# Stream name, write out, append to the session and color for each type
+output_types = {
+    OutputType.User: ("stdout", True, True, ""),
+    OutputType.Assistant: ("stdout", True, True, "\033[36m"),
+    OutputType.System: ("stderr", False, True, "\033[32m"),
+    OutputType.Info: ("stderr", True, False, ""),
+    OutputType.Error: ("stderr", True, False, "\033[31m"),
+}
 
+# Streamed output is written at most this often or once this many
+# characters are pending
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_SIZE = 4096
 
-def save_session(filename: str):
-    dir = get_cache_dir()
-    if dir is None:
-        return
 
-    os.makedirs(dir, exist_ok=True)
+def open_session(filename: str, fsync: str):
+    global session_journal
 
-    with open(dir + "/" + filename, "w") as f:
-        json.dump(output_buffer, f)
+    import session
 
+    path = filename
+    if not os.path.isabs(path):
+        dir = ai.get_cache_dir()
+        if dir is None:
+            return
+        path = dir + "/" + filename
 
-def append_to_session(type: OutputType, content: str):
-    global output_buffer
+    session_journal = session.SessionJournal(path, fsync)
+    at_exit(session_journal.close)
 
-    if len(content) == 0:
-        return
 
-    if len(output_buffer) > 0 and output_buffer[-1]["type"] == type.name:
-        output_buffer[-1]["content"] += content
-    else:
-        output_buffer.append(
-            {
-                "type": type.name,
-                "content": content,
-            },
-        )
+def at_exit(function, *args):
+    # Run when the invocation ends, which in daemon mode is not process exit
+    cleanups.append((function, args))
 
 
-def output(type: OutputType, content, *, end="\n", flush: bool = False):
-    map = {
-        OutputType.User: (sys.stdout, True, True, ""),
-        OutputType.Assistant: (sys.stdout, True, True, "\033[36m"),
-        OutputType.System: (sys.stderr, False, True, "\033[32m"),
-        OutputType.Info: (sys.stderr, True, False, ""),
-        OutputType.Error: (sys.stderr, True, False, "\033[31m"),
-    }
+def run_cleanups():
+    while len(cleanups) > 0:
+        function, args = cleanups.pop()
+        try:
+            function(*args)
+        except Exception as e:
+            print(f"Cleanup failed: {e}", file=sys.stderr)
+
+
+def append_to_session(type: OutputType, content: str):
+    if session_journal is not None:
+        session_journal.append(type.name, content)
 
-    (file, write_out, append, color) = map[type]
+
+def output(type: OutputType, content, *, end="\n", flush: bool = False):
+    (stream, write_out, append, color) = output_types[type]
+    file = getattr(sys, stream)
 
     if append:
         append_to_session(type, str(content))
@@ -83,6 +91,80 @@ def output(type: OutputType, content, *, end="\n", flush: bool = False):
         print(content, file=file, end=end, flush=flush)
 
 
+class StreamRenderer:
+    def __init__(self, type: OutputType):
+        (stream, write_out, append, color) = output_types[type]
+        self.type = type
+        self.file = getattr(sys, stream)
+        self.write_out = write_out
+        self.append = append
+        self.color = color if enable_color else ""
+        self.is_tty = self.file.isatty()
+        self.parts = []
+        self.pending = []
+        self.pending_size = 0
+        self.flushed_at = time.monotonic()
+        # Flushes text that would otherwise wait for the next delta while
+        # the model pauses
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def write(self, data: str):
+        with self.lock:
+            self.parts.append(data)
+            self.pending.append(data)
+            self.pending_size += len(data)
+
+            # Without a terminal nobody watches the deltas arrive, the buffered
+            # stream takes them as they are
+            if self.write_out and not self.is_tty:
+                self.file.write(data)
+
+            elapsed = time.monotonic() - self.flushed_at
+            if (
+                self.pending_size >= STREAM_FLUSH_SIZE
+                or elapsed >= STREAM_FLUSH_INTERVAL
+            ):
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(
+                    STREAM_FLUSH_INTERVAL - elapsed,
+                    self.flush,
+                )
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        self.flushed_at = time.monotonic()
+        if len(self.pending) == 0:
+            return
+
+        span = "".join(self.pending)
+        self.pending = []
+        self.pending_size = 0
+
+        if self.append:
+            append_to_session(self.type, span)
+        if self.write_out:
+            if self.is_tty:
+                if self.color:
+                    span = self.color + span + "\033[0m"
+                self.file.write(span)
+            self.file.flush()
+
+    def finish(self) -> str:
+        self.flush()
+        return "".join(self.parts)
+
+
 def switch_input():
     import platform
 
@@ -100,21 +182,73 @@ def get_input(prompt: str = "") -> str:
     return sys.stdin.read()
 
 
-def print_completion(completion, is_stream: bool):
+def print_completion(
+    completion,
+    is_stream: bool,
+    step: Optional[metrics.Step] = None,
+    history: Optional[list] = None,
+):
     result = ""
+    usage = None
     if is_stream:
-        for chunk in completion:
-            if chunk.choices[0].delta.content:
-                data = chunk.choices[0].delta.content
-                output(OutputType.Assistant, data, end="", flush=True)
-                result += data
+        renderer = StreamRenderer(OutputType.Assistant)
+        try:
+            for chunk in completion:
+                # With include_usage the last chunk has no choices
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if step is not None:
+                        step.record_chunk()
+                    renderer.write(chunk.choices[0].delta.content)
+        finally:
+            result = renderer.finish()
+            # Release the connection right away if the stream is interrupted
+            if hasattr(completion, "close"):
+                completion.close()
     else:
         result = completion.choices[0].message.content
+        usage = getattr(completion, "usage", None)
+        if step is not None:
+            step.record_chunk()
         output(OutputType.Assistant, result)
 
+    if step is not None:
+        step.finish(usage, history, result)
+
+    if session_journal is not None:
+        session_journal.flush()
+
     return result
 
 
+def complete(
+    driver,
+    history: list,
+    is_stream: bool,
+    temperature: float,
+    model_name: str,
+    step_name: str,
+) -> str:
+    step = metrics.start_step(step_name, model_name)
+
+    completion, error = driver.perform_request(
+        history,
+        is_stream,
+        temperature,
+        model_name,
+    )
+
+    if error is not None:
+        output(OutputType.Error, error)
+        exit(1)
+
+    if step is not None:
+        step.record_response()
+
+    return print_completion(completion, is_stream, step, history)
+
+
 def list_patterns():
     patterns, error = ai.list_patterns()
     if error is not None:
@@ -130,6 +264,68 @@ def list_models():
         print(model)
 
 
+def load_driver(
+    model: str,
+    completion_cache=None,
+    refresh_cache: bool = False,
+    is_async: bool = False,
+    context_strategy: str = "none",
+    context_budget: Optional[int] = None,
+):
+    completion_model, backends, error = models_loader.get_completion_model_backends(
+        model,
+    )
+
+    if error is not None:
+        output(OutputType.Error, error)
+        exit(1)
+
+    # The driver stack is asynchronous, the sync facade shares one event loop
+    # and its clients across requests
+    if len(backends) > 1:
+        import router
+
+        driver, error = router.create_driver(
+            backends,
+            completion_model.hedge_after,
+            shared=not is_async,
+        )
+    else:
+        driver, error = backends[0][2].get_async_driver(shared=not is_async)
+
+    if error is not None:
+        output(OutputType.Error, error)
+        exit(1)
+
+    if completion_cache is not None:
+        from cache import CachedDriver
+
+        scope = [
+            (provider_name, provider.base_address)
+            for _, provider_name, provider in backends
+        ]
+        driver = CachedDriver(driver, completion_cache, refresh_cache, scope)
+
+    if not is_async:
+        from facade import SyncDriver
+
+        driver = SyncDriver(driver)
+
+    if not is_async and context_strategy != "none":
+        import context
+
+        if context_budget is None:
+            context_budget = context.get_budget(
+                completion_model.context_window,
+                completion_model.max_output_tokens,
+            )
+        if context_budget is not None:
+            window = context.ContextWindow(context_budget, context_strategy)
+            driver = context.ContextDriver(driver, window)
+
+    return driver, completion_model.model_name
+
+
 def chat(
     history: list,
     is_stream: bool,
@@ -139,24 +335,22 @@ def chat(
 ):
     output(OutputType.Info, "\nStarting Chat session")
     switch_input()
+    turn = 0
     while True:
         stdin = input("\n> ")
 
         history.append({"role": "user", "content": stdin})
         append_to_session(OutputType.User, stdin)
 
-        completion, error = driver.perform_request(
+        turn += 1
+        result = complete(
+            driver,
             history,
             is_stream,
             temperature,
             model_name,
+            f"chat {turn}",
         )
-
-        if error is not None:
-            output(OutputType.Error, error)
-            exit(1)
-
-        result = print_completion(completion, is_stream)
         history.append({"role": "assistant", "content": result})
 
 
@@ -168,6 +362,11 @@ def perform(
     is_stream: bool,
     model: str,
     temperature: float,
+    completion_cache=None,
+    refresh_cache: bool = False,
+    context_strategy: str = "none",
+    context_budget: Optional[int] = None,
+    step_cache=None,
 ):
     history = []
 
@@ -178,116 +377,325 @@ def perform(
         exit(1)
 
     output(OutputType.Info, "Applying pattern: " + patterns[0])
-    system_input, user_input, error = ai.load_pattern(
-        patterns[0],
-        system_input,
-        user_input,
-    )
+    with metrics.phase("load pattern " + patterns[0]):
+        system_input, user_input, error = ai.load_pattern(
+            patterns[0],
+            system_input,
+            user_input,
+        )
 
     if error is not None:
         output(OutputType.Error, error)
         exit(1)
 
-    completion_model, provider, error = models_loader.get_completion_model_and_provider(
+    driver = None
+    model_name = None
+    step_key = None
+
+    if system_input != "":
+        for index, pattern in enumerate(patterns):
+            if index > 0:
+                output(OutputType.Info, "\nApplying pattern: " + pattern)
+                with metrics.phase("load pattern " + pattern):
+                    system_input, user_input, error = ai.load_pattern(
+                        pattern,
+                        user_input=result,
+                    )
+                if error is not None:
+                    output(OutputType.Error, error)
+                    exit(1)
+                if system_input == "":
+                    output(
+                        OutputType.Error,
+                        "System input required for subsequent patterns",
+                    )
+                    exit(1)
+
+            append_to_session(OutputType.System, system_input)
+            if user_input is not None:
+                append_to_session(OutputType.User, user_input)
+            ai.build_history(history, system_input, user_input)
+
+            result = None
+            if step_cache is not None:
+                # Each key includes the previous one, a changed step
+                # invalidates every step after it
+                step_key = get_step_key(
+                    step_key,
+                    model,
+                    temperature,
+                    context_strategy,
+                    context_budget,
+                    system_input,
+                    user_input,
+                )
+                if step_key is not None and not refresh_cache:
+                    entry = step_cache.get(step_key)
+                    if entry is not None:
+                        result = entry["content"]
+                        output(OutputType.Info, f"Step {pattern} served from cache")
+                        output(
+                            OutputType.Assistant,
+                            result,
+                            end="" if is_stream else "\n",
+                        )
+
+            if result is None:
+                # Only loaded once a step has to run
+                if driver is None:
+                    with metrics.phase("load driver"):
+                        driver, model_name = load_driver(
+                            model,
+                            completion_cache,
+                            refresh_cache,
+                            context_strategy=context_strategy,
+                            context_budget=context_budget,
+                        )
+
+                result = complete(
+                    driver,
+                    history,
+                    is_stream,
+                    temperature,
+                    model_name,
+                    pattern,
+                )
+                if step_key is not None:
+                    step_cache.put(step_key, {"content": result})
+
+            history.append({"role": "assistant", "content": result})
+
+    if is_chat:
+        if driver is None:
+            with metrics.phase("load driver"):
+                driver, model_name = load_driver(
+                    model,
+                    completion_cache,
+                    refresh_cache,
+                    context_strategy=context_strategy,
+                    context_budget=context_budget,
+                )
+        chat(history, is_stream, temperature, model_name, driver)
+
+
+def get_step_key(
+    previous_key: Optional[str],
+    model: str,
+    temperature: float,
+    context_strategy: str,
+    context_budget: Optional[int],
+    system_input: str,
+    user_input: Optional[str],
+) -> Optional[str]:
+    from cache import make_key
+
+    completion_model, backends, error = models_loader.get_completion_model_backends(
         model,
     )
-
     if error is not None:
-        output(OutputType.Error, error)
-        exit(1)
+        return None
+
+    return make_key(
+        previous_key,
+        completion_model.model_name,
+        [
+            (model_name, provider_name, provider.base_address)
+            for model_name, provider_name, provider in backends
+        ],
+        temperature,
+        context_strategy,
+        context_budget,
+        system_input,
+        user_input,
+    )
 
-    model_name = completion_model.model_name
-    driver, error = provider.get_driver()
 
-    if system_input != "":
-        append_to_session(OutputType.System, system_input)
-        if user_input is not None:
-            append_to_session(OutputType.User, user_input)
-        ai.build_history(history, system_input, user_input)
+async def perform_batch(
+    patterns: list[str],
+    source: str,
+    out,
+    jobs: int,
+    user_input: str,
+    system_input: str,
+    model: str,
+    temperature: float,
+    completion_cache=None,
+    refresh_cache: bool = False,
+):
+    import batch
 
-        completion, error = driver.perform_request(
-            history,
-            is_stream,
+    driver, model_name = load_driver(
+        model,
+        completion_cache,
+        refresh_cache,
+        is_async=True,
+    )
+
+    try:
+        count, failures = await batch.run_batch(
+            driver,
+            patterns,
+            batch.iter_inputs(source),
+            out,
+            system_input or "",
+            user_input,
             temperature,
             model_name,
+            jobs,
         )
+    finally:
+        await driver.close()
 
-        if error is not None:
-            output(OutputType.Error, error)
-            exit(1)
+    # A mistyped path must not pass as an empty batch
+    if count == 0:
+        output(OutputType.Error, f"No inputs found in '{source}'")
+        exit(1)
 
-        result = print_completion(completion, is_stream)
-        history.append({"role": "assistant", "content": result})
+    output(OutputType.Info, f"Processed {count} inputs, {failures} failed")
+    if failures > 0:
+        exit(1)
 
-        for pattern in patterns[1:]:
-            output(OutputType.Info, "\nApplying pattern: " + pattern)
-            system_input, user_input, error = ai.load_pattern(
-                pattern,
-                user_input=result,
-            )
-            if error is not None:
-                output(OutputType.Error, error)
-                exit(1)
-            if system_input == "":
-                output(
-                    OutputType.Error,
-                    "System input required for subsequent patterns",
-                )
-                exit(1)
-            append_to_session(OutputType.System, system_input)
-            if user_input is not None:
-                append_to_session(OutputType.User, user_input)
-            ai.build_history(history, system_input, user_input)
 
-            completion, error = driver.perform_request(
-                history,
-                is_stream,
-                temperature,
-                model_name,
-            )
+async def perform_fan_out(
+    patterns: list[str],
+    user_input: str,
+    system_input: str,
+    is_json: bool,
+    model: str,
+    temperature: float,
+    completion_cache=None,
+    refresh_cache: bool = False,
+):
+    import batch
 
+    driver, model_name = load_driver(
+        model,
+        completion_cache,
+        refresh_cache,
+        is_async=True,
+    )
+
+    results = {}
+    failed = False
+    try:
+        async for pattern, result, error in batch.run_fan_out(
+            driver,
+            patterns,
+            user_input,
+            system_input or "",
+            temperature,
+            model_name,
+        ):
             if error is not None:
-                output(OutputType.Error, error)
-                exit(1)
+                output(OutputType.Error, f"Pattern '{pattern}' failed: {error}")
+                failed = True
+                continue
+
+            if is_json:
+                results[pattern] = result
+            else:
+                output(OutputType.Assistant, f"# {pattern}\n\n{result.strip()}\n")
+    finally:
+        await driver.close()
+
+    if is_json:
+        ordered = {
+            pattern: results[pattern] for pattern in patterns if pattern in results
+        }
+        output(OutputType.Assistant, json.dumps(ordered, ensure_ascii=False))
+
+    if failed:
+        exit(1)
 
-            result = print_completion(completion, is_stream)
-            history.append({"role": "assistant", "content": result})
 
-    if is_chat:
-        chat(history, is_stream, temperature, model_name, driver)
+async def perform_map_reduce(
+    patterns: list[str],
+    reduce_patterns: list[str],
+    user_input: str,
+    system_input: str,
+    chunk_tokens: int,
+    chunk_overlap: int,
+    jobs: int,
+    model: str,
+    temperature: float,
+    completion_cache=None,
+    refresh_cache: bool = False,
+):
+    import chunking
+
+    driver, model_name = load_driver(
+        model,
+        completion_cache,
+        refresh_cache,
+        is_async=True,
+    )
+
+    output(
+        OutputType.Info,
+        "Applying patterns to chunks: " + ", ".join(patterns),
+    )
+    output(OutputType.Info, "Reducing with: " + ", ".join(reduce_patterns))
+
+    try:
+        result, error = await chunking.run_map_reduce(
+            driver,
+            patterns,
+            reduce_patterns,
+            user_input,
+            chunk_tokens,
+            chunk_overlap,
+            system_input or "",
+            temperature,
+            model_name,
+            jobs,
+        )
+    finally:
+        await driver.close()
+
+    if error is not None:
+        output(OutputType.Error, error)
+        exit(1)
+
+    output(OutputType.Assistant, result)
 
 
 def load_environment():
+    env_file = os.path.dirname(os.path.realpath(__file__)) + "/.env"
+    if not os.path.isfile(env_file):
+        return
+
     import dotenv
 
-    dotenv.load_dotenv(os.path.dirname(os.path.realpath(__file__)) + "/.env")
+    dotenv.load_dotenv(env_file)
 
 
-def load_models():
-    global_models_file = (
-        os.path.dirname(
-            os.path.realpath(__file__),
-        )
-        + "/models.json"
-    )
+def report_stats(show_summary: bool, path: Optional[str]):
+    if show_summary:
+        output(OutputType.Info, "\n" + metrics.collector.format_summary())
+    if path is not None:
+        try:
+            metrics.write_report(path)
+        except OSError as e:
+            output(OutputType.Error, f"Failed to write stats to '{path}': {e}")
 
-    if os.path.isfile(global_models_file):
-        models_loader.load_models_file(global_models_file)
 
-    user_config_path = None
+def load_models():
+    global models_state
 
-    if os.getenv("XDG_CONFIG_HOME") is not None:
-        user_config_path = os.getenv("XDG_CONFIG_HOME", "") + "/ai-cli"
-    elif os.getenv("HOME"):
-        user_config_path = os.getenv("HOME", "") + "/.config/ai-cli"
-    elif os.getenv("LOCALAPPDATA"):
-        user_config_path = os.getenv("LOCALAPPDATA", "") + "/ai-cli"
+    files = models_loader.get_models_files()
 
-    if user_config_path is not None:
-        user_models_file = user_config_path + "/models.json"
+    # A daemon keeps the registry unless the files or the tokens changed
+    state = (
+        [(path, os.path.getmtime(path)) for path in files],
+        sorted(os.environ.items()),
+    )
+    if state == models_state:
+        return
 
-        if os.path.isfile(user_models_file):
-            models_loader.load_models_file(user_models_file)
+    models_loader.reset()
+    for path in files:
+        models_loader.load_models_file(path)
+    models_state = state
 
 
 def generate_parser():
@@ -334,6 +742,109 @@ def generate_parser():
         action="store_true",
         help="Enter chat mode",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the completion cache",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached completions and store fresh ones",
+    )
+    parser.add_argument(
+        "--context-strategy",
+        type=str,
+        choices=["none", "sliding", "pinned", "summarize"],
+        default=os.getenv("AI_CONTEXT_STRATEGY") or "pinned",
+        help="How to keep the conversation within the model context window",
+    )
+    parser.add_argument(
+        "--context-budget",
+        type=int,
+        help="Maximum number of prompt tokens sent per request",
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        type=str,
+        help="Continue the chat recorded in a session journal",
+    )
+    parser.add_argument(
+        "--session-fsync",
+        type=str,
+        choices=["never", "message", "always"],
+        default="message",
+        help="When to fsync the session journal to disk",
+    )
+    parser.add_argument(
+        "-f",
+        "--fan-out",
+        action="store_true",
+        help="Apply each pattern to the input concurrently instead of chaining them",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print fan-out results as a JSON object keyed by pattern",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        help="Split the input into chunks of at most this many tokens and map-reduce them",
+    )
+    parser.add_argument(
+        "--chunk-overlap",
+        type=int,
+        default=0,
+        help="Number of tokens repeated from the previous chunk",
+    )
+    parser.add_argument(
+        "--reduce",
+        type=str,
+        action="append",
+        help="Pattern used to combine chunk results, defaults to the applied patterns",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        type=str,
+        help="Apply the patterns to every input of a directory, glob or JSONL file",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=4,
+        help="Number of inputs or chunks processed concurrently",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Write batch results to this JSONL file instead of stdout",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Serve requests from ai-client.py over a Unix socket, one at a time",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=float(os.getenv("AI_DAEMON_IDLE_TIMEOUT") or 900),
+        help="Seconds without requests before the daemon exits",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print timings and token usage of every step to stderr",
+    )
+    parser.add_argument(
+        "--stats-file",
+        type=str,
+        help="Write timings and token usage as JSON, or Prometheus text if the name ends in .prom",
+    )
     parser.add_argument(
         "PATTERN",
         type=str,
@@ -362,20 +873,35 @@ def main():
     user_input = ""
     is_chat = False
 
-    should_save_session = is_stream or is_chat
-
     enable_color = is_stream
 
     parser = generate_parser()
     args = parser.parse_args()
 
     load_environment()
-    load_models()
 
     if args.list_patterns:
         list_patterns()
         exit(0)
 
+    if args.daemon:
+        import daemon
+
+        load_models()
+        # Warm up what requests need, creating the clients imports the SDKs
+        ai.get_pattern_registry().refresh()
+        for provider in models_loader.providers.values():
+            models_loader.get_client(provider, is_async=True)
+        daemon.serve(handle_request, args.idle_timeout)
+        exit(0)
+
+    if args.stats or args.stats_file:
+        metrics.enable()
+        at_exit(report_stats, args.stats, args.stats_file)
+
+    with metrics.phase("load models"):
+        load_models()
+
     if args.list_models:
         list_models()
         exit(0)
@@ -391,13 +917,149 @@ def main():
     user_input = get_optional_argument(args, "user", "")
     is_chat = get_optional_argument(args, "chat", is_chat)
 
-    if len(patterns) == 0 and system_input is None and not is_chat:
+    if (
+        len(patterns) == 0
+        and system_input is None
+        and not is_chat
+        and args.resume is None
+    ):
         parser.print_help()
         exit(2)
 
+    completion_cache = None
+    step_cache = None
+    if not args.no_cache:
+        import cache
+
+        completion_cache = cache.open_cache("completions")
+        step_cache = cache.open_cache("steps")
+
+    if args.batch is not None:
+        import asyncio
+
+        if len(patterns) == 0:
+            output(OutputType.Error, "Batch mode requires at least one pattern")
+            exit(1)
+
+        out = sys.stdout
+        if args.output is not None:
+            out = open(args.output, "w")
+
+        try:
+            asyncio.run(
+                perform_batch(
+                    patterns,
+                    args.batch,
+                    out,
+                    max(1, args.jobs),
+                    user_input,
+                    system_input,
+                    model,
+                    temperature,
+                    completion_cache,
+                    args.refresh,
+                ),
+            )
+        except KeyboardInterrupt:
+            output(OutputType.Error, "User interrupted execution")
+            exit(1)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        exit(0)
+
+    if args.resume is not None:
+        import session
+
+        path = session.find_session(args.resume, ai.get_cache_dir())
+        if path is None:
+            output(OutputType.Error, f"Unable to locate session '{args.resume}'")
+            exit(1)
+
+        history, error = session.load_history(path)
+        if error is not None:
+            output(OutputType.Error, error)
+            exit(1)
+
+        open_session(path, args.session_fsync)
+        driver, model_name = load_driver(
+            model,
+            completion_cache,
+            args.refresh,
+            context_strategy=args.context_strategy,
+            context_budget=args.context_budget,
+        )
+        try:
+            chat(history, is_stream, temperature, model_name, driver)
+        except (KeyboardInterrupt, EOFError):
+            output(OutputType.Error, "User interrupted execution")
+        exit(0)
+
+    if is_stream or is_chat:
+        now = time.strftime("%Y%m%d%H%M%S", timestamp)
+        pattern_text = "nopattern"
+        if len(patterns) > 1:
+            pattern_text = "multiplepatterns"
+        elif len(patterns) == 1:
+            pattern_text = patterns[0]
+        open_session(f"{now}_{pattern_text}.jsonl", args.session_fsync)
+
     if not sys.stdin.isatty():
         user_input += sys.stdin.read()
 
+    if args.fan_out:
+        import asyncio
+
+        if len(patterns) == 0:
+            output(OutputType.Error, "Fan-out mode requires at least one pattern")
+            exit(1)
+
+        try:
+            asyncio.run(
+                perform_fan_out(
+                    patterns,
+                    user_input,
+                    system_input,
+                    args.json,
+                    model,
+                    temperature,
+                    completion_cache,
+                    args.refresh,
+                ),
+            )
+        except KeyboardInterrupt:
+            output(OutputType.Error, "User interrupted execution")
+            exit(1)
+        exit(0)
+
+    if args.chunk_tokens is not None:
+        import asyncio
+
+        if len(patterns) == 0:
+            output(OutputType.Error, "Chunked mode requires at least one pattern")
+            exit(1)
+
+        try:
+            asyncio.run(
+                perform_map_reduce(
+                    patterns,
+                    args.reduce or patterns,
+                    user_input,
+                    system_input,
+                    max(1, args.chunk_tokens),
+                    max(0, args.chunk_overlap),
+                    max(1, args.jobs),
+                    model,
+                    temperature,
+                    completion_cache,
+                    args.refresh,
+                ),
+            )
+        except KeyboardInterrupt:
+            output(OutputType.Error, "User interrupted execution")
+            exit(1)
+        exit(0)
+
     try:
         if patterns is not None:
             perform(
@@ -408,20 +1070,44 @@ def main():
                 is_stream,
                 model,
                 temperature,
+                completion_cache,
+                args.refresh,
+                args.context_strategy,
+                args.context_budget,
+                step_cache,
             )
     except KeyboardInterrupt:
         output(OutputType.Error, "User interrupted execution")
 
-    if should_save_session:
-        now = time.strftime("%Y%m%d%H%M%S", timestamp)
-        pattern_text = "nopttern"
-        if len(patterns) > 1:
-            pattern_text = "multiplepatterns"
-        else:
-            pattern_text = patterns[0]
-        filename = f"{now}_{pattern_text}.json"
-        save_session(filename)
+    if completion_cache is not None:
+        output(
+            OutputType.Info,
+            f"\nCache: {completion_cache.hits} hits, {completion_cache.misses} misses",
+        )
+
+
+def handle_request(argv: list[str], stdin, stdout, stderr) -> int:
+    global enable_color
+    global session_journal
+
+    saved = (sys.argv, sys.stdin, sys.stdout, sys.stderr)
+    sys.argv = [sys.argv[0]] + argv
+    sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+    enable_color = False
+    session_journal = None
+    metrics.collector = None
+    try:
+        main()
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    finally:
+        run_cleanups()
+        sys.argv, sys.stdin, sys.stdout, sys.stderr = saved
 
 
 if __name__ == "__main__":
+    atexit.register(run_cleanups)
     main()
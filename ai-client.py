@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import json
+import os
+import socket
+import sys
+import threading
+from typing import Optional
+
+import daemon
+import models
+
+
+def run_locally():
+    cli = os.path.dirname(os.path.realpath(__file__)) + "/ai-cli.py"
+    os.execv(sys.executable, [sys.executable, cli] + sys.argv[1:])
+
+
+def connect() -> Optional[socket.socket]:
+    path = daemon.get_socket_path()
+    if daemon.check_directory(os.path.dirname(path)) is not None:
+        # Never send a request to a socket another user could control
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def send_input(connection: socket.socket):
+    try:
+        if not sys.stdin.isatty():
+            while True:
+                data = sys.stdin.buffer.read1(65536)
+                if not data:
+                    break
+                connection.sendall(data)
+        connection.shutdown(socket.SHUT_WR)
+    except OSError:
+        # The daemon finished without reading everything
+        pass
+
+
+def send_request(connection: socket.socket):
+    header = {
+        "argv": sys.argv[1:],
+        "cwd": os.getcwd(),
+        "env": daemon.filter_environment(
+            os.environ,
+            models.get_token_variables(models.get_models_files()),
+        ),
+        "stdin_isatty": sys.stdin.isatty(),
+        "stdout_isatty": sys.stdout.isatty(),
+        "stderr_isatty": sys.stderr.isatty(),
+    }
+    connection.sendall(json.dumps(header).encode("utf-8") + b"\n")
+
+    # Input is sent while the answer streams back
+    threading.Thread(target=send_input, args=(connection,), daemon=True).start()
+
+
+def receive_response(connection: socket.socket) -> int:
+    outputs = {daemon.STDOUT: sys.stdout.buffer, daemon.STDERR: sys.stderr.buffer}
+    while True:
+        header = daemon.read_exactly(connection, daemon.HEADER.size)
+        if header is None:
+            print("Error: The daemon closed the connection", file=sys.stderr)
+            return 1
+        kind, length = daemon.HEADER.unpack(header)
+        payload = daemon.read_exactly(connection, length) if length > 0 else b""
+        if payload is None:
+            print("Error: The daemon closed the connection", file=sys.stderr)
+            return 1
+
+        if kind == daemon.EXIT:
+            return int(payload)
+        output = outputs[kind]
+        output.write(payload)
+        output.flush()
+
+
+def main():
+    if any(argument in daemon.LOCAL_ARGUMENTS for argument in sys.argv[1:]):
+        run_locally()
+
+    connection = connect()
+    if connection is None:
+        run_locally()
+
+    try:
+        send_request(connection)
+        code = receive_response(connection)
+    except KeyboardInterrupt:
+        code = 130
+    finally:
+        connection.close()
+
+    # The input thread may still be blocked on a read that never ends
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,24 @@
+import json
 import os
+import threading
 from typing import Any
 from typing import Optional
 from typing import Tuple
 
-_client = None
 
+def get_provider():
+    import models
 
-def get_client() -> Tuple[Any, Optional[str]]:
-    from openai import OpenAI
-
-    global _client
+    api_key = os.getenv("OPENAI_API_KEY", "not-needed")
+    api_url = os.getenv("OPENAI_BASE_URL", "")
+    if api_url.strip() == "":
+        api_url = None
 
-    try:
-        api_key = os.getenv("OPENAI_API_KEY", "not-needed")
-        api_url = os.getenv("OPENAI_BASE_URL", "")
-        if api_url.strip() == "":
-            api_url = None
+    return models.Provider("openai", api_url, api_key)
 
-        _client = OpenAI(base_url=api_url, api_key=api_key)
-    except Exception as e:
-        return None, f"Failed to create OpenAI client: {e}"
 
-    return _client, None
+def get_client() -> Tuple[Any, Optional[str]]:
+    return get_provider().get_client()
 
 
 def get_user_patterns_path() -> Optional[str]:
@@ -36,6 +33,18 @@ def get_user_patterns_path() -> Optional[str]:
     return user_patterns_path
 
 
+def get_cache_dir() -> Optional[str]:
+    if os.getenv("XDG_CACHE_HOME") is not None:
+        return os.getenv("XDG_CACHE_HOME", "") + "/ai-cli"
+    elif os.getenv("HOME") is not None:
+        return os.getenv("HOME", "") + "/.cache/ai-cli"
+    elif os.getenv("TMP") is not None:
+        return os.getenv("TMP", "") + "/ai-cli"
+    elif os.getenv("TEMP") is not None:
+        return os.getenv("TEMP", "") + "/ai-cli"
+    return None
+
+
 def get_builtin_patterns_path() -> str:
     return os.path.dirname(os.path.realpath(__file__)) + "/patterns"
 
@@ -47,33 +56,154 @@ def list_pattern_from_directory(path: str):
     return os.listdir(path)
 
 
-def find_pattern_path(pattern_name: str) -> Optional[str]:
-    user_patterns_path = get_user_patterns_path()
+def get_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
+
+def read_optional_file(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read()
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+
+
+class PatternRegistry:
+    def __init__(self, directories: list[str], index_path: Optional[str] = None):
+        # Directories are ordered by priority, earlier ones override later ones
+        self.directories = directories
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self._index = {}
+        self._contents = {}
+
+    def _directory_mtimes(self) -> list:
+        return [get_mtime(directory) for directory in self.directories]
+
+    def _load_index(self, mtimes: list) -> bool:
+        if self.index_path is None:
+            return False
+
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("directories") != self.directories or data.get("mtimes") != mtimes:
+            return False
+
+        self._index = data["patterns"]
+        return True
+
+    def _save_index(self, mtimes: list):
+        if self.index_path is None:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        "directories": self.directories,
+                        "mtimes": mtimes,
+                        "patterns": self._index,
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        index = {}
+        for directory in reversed(self.directories):
+            for name in list_pattern_from_directory(directory):
+                index[name] = directory + "/" + name
+        self._index = index
+
+    def refresh(self):
+        mtimes = self._directory_mtimes()
+        if mtimes == self._mtimes:
+            return
+
+        if not self._load_index(mtimes):
+            self._scan()
+            self._save_index(mtimes)
+        self._mtimes = mtimes
+
+    def find(self, name: str) -> Optional[str]:
+        with self._lock:
+            self.refresh()
+            return self._index.get(name)
+
+    def names(self) -> list[str]:
+        with self._lock:
+            self.refresh()
+            return sorted(self._index)
+
+    def load(self, name: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        with self._lock:
+            self.refresh()
+            path = self._index.get(name)
+            if path is None:
+                return None, None, f"Unable to locate pattern '{name}'"
+
+            mtimes = (
+                get_mtime(path),
+                get_mtime(path + "/system.md"),
+                get_mtime(path + "/user.md"),
+            )
+            if mtimes[0] is None:
+                return None, None, f"Pattern '{name}' not found"
+
+            cached = self._contents.get(name)
+            if cached is not None and cached[0] == path and cached[1] == mtimes:
+                return cached[2], cached[3], None
+
+            system_input = read_optional_file(path + "/system.md")
+            user_input = read_optional_file(path + "/user.md")
+            self._contents[name] = (path, mtimes, system_input, user_input)
+            return system_input, user_input, None
+
+
+_registry = None
+
+
+def get_pattern_registry() -> PatternRegistry:
+    global _registry
+
+    directories = [get_builtin_patterns_path()]
+    user_patterns_path = get_user_patterns_path()
     if user_patterns_path is not None:
-        patterns = list_pattern_from_directory(user_patterns_path)
-        if pattern_name in patterns:
-            return user_patterns_path + "/" + pattern_name
+        directories.insert(0, user_patterns_path)
 
-    builtin_patterns_path = get_builtin_patterns_path()
+    if _registry is None or _registry.directories != directories:
+        index_path = None
+        cache_dir = get_cache_dir()
+        if cache_dir is not None:
+            index_path = cache_dir + "/patterns-index.json"
+        _registry = PatternRegistry(directories, index_path)
 
-    if builtin_patterns_path is not None:
-        patterns = list_pattern_from_directory(builtin_patterns_path)
-        if pattern_name in patterns:
-            return builtin_patterns_path + "/" + pattern_name
+    return _registry
 
-    return None
+
+def find_pattern_path(pattern_name: str) -> Optional[str]:
+    return get_pattern_registry().find(pattern_name)
 
 
 def list_patterns():
-    patterns = []
-    patterns += list_pattern_from_directory(get_builtin_patterns_path())
+    return get_pattern_registry().names(), None
 
-    user_patterns_path = get_user_patterns_path()
-    if user_patterns_path is not None:
-        patterns += list_pattern_from_directory(user_patterns_path)
 
-    return patterns, None
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text with common tokenizers
+    return len(text) // 4 + 1
 
 
 def build_history(
@@ -92,21 +222,18 @@ def load_pattern(
     system_input: Optional[str] = "",
     user_input: Optional[str] = "",
 ):
-    pattern_path = find_pattern_path(pattern)
-
-    if pattern_path is None:
-        return None, None, f"Unable to locate pattern '{pattern}'"
+    pattern_system_input, pattern_user_input, error = get_pattern_registry().load(
+        pattern,
+    )
 
-    if not os.path.exists(pattern_path):
-        return None, None, f"Pattern '{pattern}' not found"
+    if error is not None:
+        return None, None, error
 
-    if os.path.isfile(pattern_path + "/system.md"):
-        with open(pattern_path + "/system.md") as f:
-            system_input = f.read()
+    if pattern_system_input is not None:
+        system_input = pattern_system_input
 
-    if user_input == "" and os.path.isfile(pattern_path + "/user.md"):
-        with open(pattern_path + "/user.md") as f:
-            user_input = f.read()
+    if user_input == "" and pattern_user_input is not None:
+        user_input = pattern_user_input
 
     return system_input, user_input, None
 
@@ -117,28 +244,19 @@ def perform_request(
     temperature: float = 0.7,
     model: Optional[str] = None,
 ):
-    from openai import AuthenticationError, RateLimitError
-
-    client, error = get_client()
+    driver, error = get_provider().get_driver()
     if error:
         return None, error
 
     if model is None:
         model = os.getenv("AI_MODEL", "gpt-4o")
 
-    try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=history,
-            temperature=temperature,
-            stream=is_stream,
-        )
-
-        return completion, None
-    except AuthenticationError as e:
-        return None, "Failed to authenticate to server: " + e.body["message"]
-    except RateLimitError as e:
-        return None, "API rate limit exceeded: " + e.body["message"]
+    return driver.perform_request(
+        history,
+        is_stream,
+        temperature,
+        model,
+    )
 
 
 def extract_completion(completion, is_stream: bool):
@@ -152,3 +270,98 @@ def extract_completion(completion, is_stream: bool):
         output = completion.choices[0].message.content
 
     return output
+
+
+def build_chain_step(
+    history: list,
+    index: int,
+    pattern: str,
+    user_input: str,
+    system_input: Optional[str],
+    result: Optional[str],
+) -> Optional[str]:
+    if index == 0:
+        system_input, user_input, error = load_pattern(
+            pattern,
+            system_input,
+            user_input,
+        )
+    else:
+        system_input, user_input, error = load_pattern(
+            pattern,
+            user_input=result,
+        )
+    if error is not None:
+        return error
+    if system_input == "":
+        return f"System input required for pattern '{pattern}'"
+
+    build_history(history, system_input, user_input)
+    return None
+
+
+def run_patterns(
+    driver,
+    patterns: list[str],
+    user_input: str = "",
+    system_input: Optional[str] = "",
+    temperature: float = 0.7,
+    model: Optional[str] = None,
+):
+    from facade import run
+
+    # Takes a sync facade and runs the chain on its event loop
+    return run(
+        run_patterns_async(
+            driver.driver,
+            patterns,
+            user_input,
+            system_input,
+            temperature,
+            model,
+        ),
+    )
+
+
+async def run_patterns_async(
+    driver,
+    patterns: list[str],
+    user_input: str = "",
+    system_input: Optional[str] = "",
+    temperature: float = 0.7,
+    model: Optional[str] = None,
+    is_stream: bool = False,
+):
+    from driver_openai import iter_completion
+
+    history = []
+    result = None
+
+    for index, pattern in enumerate(patterns):
+        error = build_chain_step(
+            history,
+            index,
+            pattern,
+            user_input,
+            system_input,
+            result,
+        )
+        if error is not None:
+            return None, error
+
+        completion, error = await driver.perform_request(
+            history,
+            is_stream,
+            temperature,
+            model,
+        )
+        if error is not None:
+            return None, error
+
+        # Cancelling the chain closes a running stream right away
+        result = "".join(
+            [part async for part in iter_completion(completion, is_stream)],
+        )
+        history.append({"role": "assistant", "content": result})
+
+    return result, None
@@ -0,0 +1,242 @@
+import io
+import os
+import re
+import shutil
+import subprocess
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from typing import Tuple
+
+SEGMENT_RETRIES = 3
+MAX_OVERLAP_WORDS = 60
+# Shorter matches are too likely to be a repeated word like "the"
+MIN_OVERLAP_WORDS = 3
+SEGMENT_FORMATS = ["flac", "wav"]
+
+
+def get_duration(path: str) -> Optional[float]:
+    if path.lower().endswith(".wav"):
+        try:
+            with wave.open(path, "rb") as f:
+                return f.getnframes() / f.getframerate()
+        except (wave.Error, EOFError, OSError):
+            pass
+
+    if shutil.which("ffprobe") is None:
+        return None
+
+    process = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    try:
+        return float(process.stdout.strip())
+    except ValueError:
+        return None
+
+
+def read_wav_segment(path: str, start: float, length: float) -> bytes:
+    with wave.open(path, "rb") as source:
+        rate = source.getframerate()
+        source.setpos(min(int(start * rate), source.getnframes()))
+        frames = source.readframes(int(length * rate))
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as target:
+            target.setnchannels(source.getnchannels())
+            target.setsampwidth(source.getsampwidth())
+            target.setframerate(rate)
+            target.writeframes(frames)
+
+    return buffer.getvalue()
+
+
+def read_segment(
+    path: str,
+    start: float,
+    length: float,
+    format: str = "flac",
+) -> Tuple[bytes, str]:
+    if shutil.which("ffmpeg") is not None:
+        # Mono 16 kHz keeps uploads small without hurting recognition
+        process = subprocess.run(
+            [
+                "ffmpeg",
+                "-v",
+                "error",
+                "-ss",
+                str(start),
+                "-t",
+                str(length),
+                "-i",
+                path,
+                "-ac",
+                "1",
+                "-ar",
+                "16000",
+                "-f",
+                format,
+                "-",
+            ],
+            capture_output=True,
+            check=True,
+        )
+        return process.stdout, "segment." + format
+
+    return read_wav_segment(path, start, length), "segment.wav"
+
+
+def can_segment(path: str) -> bool:
+    return shutil.which("ffmpeg") is not None or path.lower().endswith(".wav")
+
+
+def plan_segments(
+    duration: float,
+    segment_seconds: float,
+    overlap_seconds: float,
+) -> list[Tuple[float, float]]:
+    step = max(1.0, segment_seconds - overlap_seconds)
+    segments = []
+    start = 0.0
+    while start < duration:
+        segments.append((start, min(segment_seconds, duration - start)))
+        if start + segment_seconds >= duration:
+            break
+        start += step
+    return segments
+
+
+def normalize_word(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def stitch(transcripts: list[str]) -> str:
+    # Consecutive segments share some audio, drop the longest run of words
+    # at the start of a segment that repeats the end of the previous one
+    words = []
+    for transcript in transcripts:
+        current = transcript.split()
+        tail = [normalize_word(word) for word in words[-MAX_OVERLAP_WORDS:]]
+        head = [normalize_word(word) for word in current[:MAX_OVERLAP_WORDS]]
+
+        overlap = 0
+        for size in range(min(len(tail), len(head)), MIN_OVERLAP_WORDS - 1, -1):
+            if tail[-size:] == head[:size]:
+                overlap = size
+                break
+
+        words += current[overlap:]
+
+    return " ".join(words)
+
+
+def transcribe_segment(
+    client,
+    model: str,
+    path: str,
+    start: float,
+    length: float,
+    cache=None,
+    cache_key: Optional[str] = None,
+    format: str = "flac",
+) -> str:
+    if cache is not None and cache_key is not None:
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return entry["content"]
+
+    data, filename = read_segment(path, start, length, format)
+
+    for attempt in range(SEGMENT_RETRIES):
+        try:
+            transcript = client.audio.transcriptions.create(
+                model=model,
+                file=(filename, data),
+            )
+            break
+        except Exception:
+            if attempt == SEGMENT_RETRIES - 1:
+                raise
+            time.sleep(2**attempt)
+
+    if cache is not None and cache_key is not None:
+        cache.put(cache_key, {"content": transcript.text})
+    return transcript.text
+
+
+def transcribe_segmented(
+    client,
+    model: str,
+    path: str,
+    duration: float,
+    segment_seconds: float,
+    overlap_seconds: float,
+    jobs: int,
+    cache=None,
+    file_hash: Optional[str] = None,
+    format: str = "flac",
+) -> str:
+    from cache import make_key
+
+    segments = plan_segments(duration, segment_seconds, overlap_seconds)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        for start, length in segments:
+            cache_key = None
+            if file_hash is not None:
+                cache_key = make_key(
+                    "audio-segment",
+                    file_hash,
+                    model,
+                    start,
+                    length,
+                    format,
+                )
+            futures.append(
+                executor.submit(
+                    transcribe_segment,
+                    client,
+                    model,
+                    path,
+                    start,
+                    length,
+                    cache,
+                    cache_key,
+                    format,
+                ),
+            )
+
+        # Every segment is awaited so successful ones are cached even if
+        # another one fails, a rerun then only retries the failed segments
+        errors = []
+        transcripts = []
+        for index, future in enumerate(futures):
+            try:
+                transcripts.append(future.result())
+            except Exception as e:
+                errors.append(f"segment {index + 1}: {e}")
+
+    if len(errors) > 0:
+        raise RuntimeError("Failed to transcribe " + ", ".join(errors))
+
+    return stitch(transcripts)
+
+
+def get_float_env(name: str, defval: float) -> float:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return defval
+    return float(value)
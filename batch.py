@@ -0,0 +1,212 @@
+import asyncio
+import glob
+import json
+import os
+import time
+from typing import AsyncIterator
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+import ai
+
+
+def read_text(path: str) -> str:
+    with open(path, "r", errors="replace") as f:
+        return f.read()
+
+
+def read_input(path: str, input_id: str) -> Tuple[str, Optional[str], Optional[str]]:
+    try:
+        return input_id, read_text(path), None
+    except OSError as e:
+        return input_id, None, f"Unable to read {path}: {e}"
+
+
+def iter_directory(path: str) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            filename = os.path.join(root, name)
+            yield read_input(filename, os.path.relpath(filename, path))
+
+
+def parse_record(
+    line: str,
+    index: int,
+) -> Tuple[str, Optional[str], Optional[str]]:
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        return str(index), None, f"Invalid JSON on line {index + 1}: {e}"
+
+    if isinstance(data, str):
+        return str(index), data, None
+    if not isinstance(data, dict):
+        return str(index), None, f"Line {index + 1} is not an object or a string"
+
+    input_id = str(data.get("id", index))
+    if not isinstance(data.get("input"), str):
+        return input_id, None, f"Line {index + 1} has no input string"
+    return input_id, data["input"], None
+
+
+def iter_jsonl(path: str) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    with open(path, "r") as f:
+        for index, line in enumerate(f):
+            if line.strip() == "":
+                continue
+            # A broken record becomes an error record, the batch goes on
+            yield parse_record(line, index)
+
+
+def iter_inputs(source: str) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    if os.path.isdir(source):
+        return iter_directory(source)
+    if source.endswith(".jsonl") and os.path.isfile(source):
+        return iter_jsonl(source)
+    return (
+        read_input(path, path)
+        for path in sorted(glob.glob(source, recursive=True))
+        if os.path.isfile(path)
+    )
+
+
+async def process_input(
+    driver,
+    patterns: list[str],
+    input_id: str,
+    user_input: str,
+    system_input: str,
+    temperature: float,
+    model: str,
+) -> dict:
+    start = time.monotonic()
+    try:
+        result, error = await ai.run_patterns_async(
+            driver,
+            patterns,
+            user_input,
+            system_input,
+            temperature,
+            model,
+        )
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+
+    return {
+        "id": input_id,
+        "result": result,
+        "error": error,
+        "duration": round(time.monotonic() - start, 3),
+    }
+
+
+def write_records(tasks, out) -> Tuple[int, int]:
+    count = 0
+    failures = 0
+    for task in tasks:
+        record = task.result()
+        count += 1
+        if record["error"] is not None:
+            failures += 1
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+    return count, failures
+
+
+async def run_batch(
+    driver,
+    patterns: list[str],
+    inputs: Iterator[Tuple[str, Optional[str], Optional[str]]],
+    out,
+    system_input: str = "",
+    user_input: str = "",
+    temperature: float = 0.7,
+    model: Optional[str] = None,
+    jobs: int = 4,
+) -> Tuple[int, int]:
+    count = 0
+    failures = 0
+    pending = set()
+
+    try:
+        for input_id, text, error in inputs:
+            if error is not None:
+                record = {
+                    "id": input_id,
+                    "result": None,
+                    "error": error,
+                    "duration": 0.0,
+                }
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+                failures += 1
+                continue
+
+            # Only as many inputs as there are workers are held in memory
+            if len(pending) >= jobs:
+                done, pending = await asyncio.wait(
+                    pending,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                done_count, done_failures = write_records(done, out)
+                count += done_count
+                failures += done_failures
+
+            pending.add(
+                asyncio.create_task(
+                    process_input(
+                        driver,
+                        patterns,
+                        input_id,
+                        user_input + text,
+                        system_input,
+                        temperature,
+                        model,
+                    ),
+                ),
+            )
+    finally:
+        # Results that are already running are written even if reading the
+        # inputs failed
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            done_count, done_failures = write_records(done, out)
+            count += done_count
+            failures += done_failures
+
+    return count, failures
+
+
+async def run_fan_out(
+    driver,
+    patterns: list[str],
+    user_input: str,
+    system_input: str = "",
+    temperature: float = 0.7,
+    model: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, Optional[str], Optional[str]]]:
+    async def apply(pattern: str):
+        try:
+            # Streamed, so a cancelled pattern stops generating right away
+            result, error = await ai.run_patterns_async(
+                driver,
+                [pattern],
+                user_input,
+                system_input,
+                temperature,
+                model,
+                is_stream=True,
+            )
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        return pattern, result, error
+
+    tasks = [asyncio.create_task(apply(pattern)) for pattern in patterns]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+
+from startup import count_imports
+from startup import measure
+
+# The modules extract.py imported at load time before extractors were lazy
+EAGER_IMPORTS = [
+    "docx",
+    "dotenv",
+    "isodate",
+    "pymupdf",
+    "bs4",
+    "googleapiclient.discovery",
+    "markdownify",
+    "youtube_transcript_api",
+]
+
+SAMPLES = {
+    ".txt": "The quick brown fox jumps over the lazy dog.\n",
+    ".html": "<html><body><h1>Title</h1><p>Some <b>text</b>.</p></body></html>\n",
+}
+
+
+def report(name: str, command: list[str], runs: int, baseline: float) -> float:
+    median = statistics.median(measure(command, runs)) - baseline
+    imports = len(count_imports(command))
+    print(f"{name:<24} {median * 1000:8.1f} ms {imports:8d} modules")
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the import cost of extract.py against eager imports",
+    )
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    available = []
+    for module in EAGER_IMPORTS:
+        try:
+            __import__(module)
+            available.append(module)
+        except ImportError:
+            sys.stderr.write(f"Skipping {module}, it is not installed\n")
+    eager = ["-c", "import " + ", ".join(available)]
+
+    baseline = statistics.median(measure(["-c", "pass"], args.runs))
+    print(f"Interpreter: {baseline * 1000:.1f} ms, times below exclude it\n")
+    print(f"{'':<24} {'time':>11} {'imports':>16}")
+
+    eager_time = report("eager imports", eager, args.runs, baseline)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for extension, content in SAMPLES.items():
+            path = os.path.join(directory, "sample" + extension)
+            with open(path, "w") as f:
+                f.write(content)
+
+            command = ["extract.py", "--no-cache", path]
+            lazy_time = report("extract " + extension, command, args.runs, baseline)
+            # Every run used to pay at least the eager imports
+            print(f"{'':<24} {(eager_time - lazy_time) * 1000:+8.1f} ms saved at least")
+
+
+if __name__ == "__main__":
+    main()
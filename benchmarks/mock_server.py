@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+import argparse
+import array
+import email.parser
+import email.policy
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+WORDS = (
+    "the quick brown fox jumps over the lazy dog while a patient model keeps "
+    "streaming tokens to a client that measures every single one of them"
+).split()
+
+
+class ServerConfig:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        token_rate: float = 0.0,
+        chunk_size: int = 1,
+        tokens: int = 200,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+    ):
+        # Seconds before the first byte, tokens per second (0 for unlimited),
+        # tokens per streamed chunk and tokens per answer
+        self.latency = latency
+        self.token_rate = token_rate
+        self.chunk_size = chunk_size
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+
+def make_tokens(count: int) -> list[str]:
+    return [WORDS[index % len(WORDS)] + " " for index in range(count)]
+
+
+def write_test_audio(path: str, seconds: int, rate: int = 8000):
+    # Every second holds a constant sample, its index, which the stand-in
+    # transcription turns back into a word
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        for index in range(seconds):
+            f.writeframes(array.array("h", [index]).tobytes() * rate)
+
+
+def get_test_word(index: int) -> str:
+    # Unique for the first 576 seconds, a periodic text would match overlaps
+    # that are not there
+    return WORDS[index % len(WORDS)] + "-" + WORDS[index // len(WORDS) % len(WORDS)]
+
+
+def get_test_transcript(seconds: int) -> str:
+    return " ".join(get_test_word(index) for index in range(seconds))
+
+
+def transcribe_test_audio(data: bytes) -> str:
+    words = []
+    with wave.open(io.BytesIO(data), "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError("Only 16 bit audio is supported")
+        rate = f.getframerate()
+        channels = f.getnchannels()
+        while True:
+            frames = f.readframes(rate)
+            samples = array.array("h", frames)[::channels]
+            # Partial seconds at the end of a segment are not a word
+            if len(samples) < rate // 2:
+                break
+            value = sorted(samples)[len(samples) // 2]
+            words.append(get_test_word(value))
+    return " ".join(words)
+
+
+def get_uploaded_file(content_type: str, body: bytes) -> bytes:
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body,
+    )
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_payload(decode=True)
+    raise ValueError("No file uploaded")
+
+
+def count_prompt_tokens(messages: list) -> int:
+    return sum(len(message.get("content") or "") // 4 + 1 for message in messages)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = ServerConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, data: dict, headers: dict = {}):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "mock"}]})
+        else:
+            self.send_json(404, {"error": {"message": "Not found"}})
+
+    def inject_error(self) -> bool:
+        config = self.config
+        if config.latency > 0:
+            time.sleep(config.latency)
+
+        if random.random() < config.error_rate:
+            headers = {"Retry-After": "0"} if config.error_status == 429 else {}
+            self.send_json(
+                config.error_status,
+                {"error": {"message": "Injected error", "type": "mock"}},
+                headers,
+            )
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        config = self.config
+
+        path = self.path.rstrip("/")
+        if path.endswith("/audio/transcriptions"):
+            self.transcribe(body)
+            return
+        if not path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        request = json.loads(body or b"{}")
+        if self.inject_error():
+            return
+
+        tokens = make_tokens(config.tokens)
+        usage = {
+            "prompt_tokens": count_prompt_tokens(request.get("messages", [])),
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = request.get("model", "mock")
+
+        if not request.get("stream"):
+            if config.token_rate > 0:
+                time.sleep(len(tokens) / config.token_rate)
+            self.send_json(
+                200,
+                {
+                    "id": "mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": "".join(tokens),
+                            },
+                            "finish_reason": "stop",
+                        },
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        start = time.perf_counter()
+        size = max(1, config.chunk_size)
+        for index in range(0, len(tokens), size):
+            if config.token_rate > 0:
+                # Pace against the start so sleeping overhead does not add up
+                delay = start + index / config.token_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            chunk = {
+                "id": "mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": "".join(tokens[index : index + size])},
+                        "finish_reason": None,
+                    },
+                ],
+            }
+            self.write_chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": "mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": usage,
+            }
+            self.write_chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def transcribe(self, body: bytes):
+        try:
+            data = get_uploaded_file(self.headers.get("Content-Type", ""), body)
+            text = transcribe_test_audio(data)
+        except (ValueError, EOFError, wave.Error) as e:
+            self.send_json(400, {"error": {"message": str(e), "type": "mock"}})
+            return
+
+        if self.inject_error():
+            return
+        self.send_json(200, {"text": text})
+
+
+def start_server(config: ServerConfig, port: int = 0) -> ThreadingHTTPServer:
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_base_url(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def start_server_process(config: ServerConfig) -> tuple:
+    # A separate process keeps the server's work out of the client's timings
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.realpath(__file__),
+            "--port",
+            "0",
+            "--latency",
+            str(config.latency),
+            "--token-rate",
+            str(config.token_rate),
+            "--chunk-size",
+            str(config.chunk_size),
+            "--tokens",
+            str(config.tokens),
+            "--error-rate",
+            str(config.error_rate),
+            "--error-status",
+            str(config.error_status),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    line = process.stdout.readline()
+    if not line.startswith("Listening on "):
+        process.kill()
+        raise RuntimeError("Mock server failed to start")
+    return process, line[len("Listening on ") :].strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local OpenAI compatible server for benchmarks",
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--token-rate", type=float, default=0.0)
+    parser.add_argument("--chunk-size", type=int, default=1)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    args = parser.parse_args()
+
+    config = ServerConfig(
+        args.latency,
+        args.token_rate,
+        args.chunk_size,
+        args.tokens,
+        args.error_rate,
+        args.error_status,
+    )
+    server = start_server(config, args.port)
+    print(f"Listening on {get_base_url(server)}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_server import get_test_transcript
+from mock_server import ServerConfig
+from mock_server import start_server_process
+from mock_server import write_test_audio
+from startup import measure
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DEFAULT_HISTORY = os.path.join(ROOT, "benchmarks", "history.jsonl")
+MODEL = "bench"
+
+sys.path.insert(0, ROOT)
+
+
+def load_cli():
+    spec = importlib.util.spec_from_file_location("ai_cli", ROOT + "/ai-cli.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_config(directory: str, base_url: str) -> str:
+    path = os.path.join(directory, "ai-cli", "models.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "providers": {
+                    MODEL: {
+                        "driver": "openai",
+                        "base_address": base_url,
+                        "token": "bench",
+                        "max_retries": 8,
+                    },
+                },
+                "completion": {
+                    MODEL: {"model_name": "mock", "provider": MODEL},
+                },
+            },
+            f,
+        )
+    return path
+
+
+@contextlib.contextmanager
+def mock_environment(config: ServerConfig):
+    import models
+
+    server, base_url = start_server_process(config)
+    with tempfile.TemporaryDirectory() as directory:
+        models.load_models_file(write_config(directory, base_url))
+        environment = dict(
+            os.environ,
+            XDG_CONFIG_HOME=directory,
+            XDG_CACHE_HOME=os.path.join(directory, "cache"),
+            OPENAI_BASE_URL=base_url,
+            OPENAI_API_KEY="bench",
+        )
+        try:
+            yield environment
+        finally:
+            server.terminate()
+            server.wait()
+
+
+@contextlib.contextmanager
+def patched_environ(values: dict):
+    saved = dict(os.environ)
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def get_driver():
+    import models
+
+    _, provider, error = models.get_completion_model_and_provider(MODEL)
+    if error is not None:
+        raise RuntimeError(error)
+    driver, error = provider.get_driver()
+    if error is not None:
+        raise RuntimeError(error)
+    return driver
+
+
+def run_cli(arguments: list[str], environment: dict, runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "ai-cli.py"] + arguments,
+            input="Benchmark input text.\n",
+            capture_output=True,
+            text=True,
+            cwd=ROOT,
+            env=environment,
+        )
+        timings.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip())
+    return timings
+
+
+def summarize(timings: list[float]) -> dict:
+    return {
+        "median_seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "max_seconds": max(timings),
+    }
+
+
+def bench_cold_start(runs: int) -> dict:
+    baseline = statistics.median(measure(["-c", "pass"], runs))
+    return {
+        "interpreter_seconds": baseline,
+        "list_patterns_seconds": statistics.median(
+            measure(["ai-cli.py", "-l"], runs),
+        ),
+        "list_models_seconds": statistics.median(
+            measure(["ai-cli.py", "-L"], runs),
+        ),
+    }
+
+
+def bench_stream(runs: int) -> dict:
+    import metrics
+
+    cli = load_cli()
+    metrics.enable()
+    config = ServerConfig(tokens=4000, chunk_size=1)
+    results = []
+    with mock_environment(config):
+        driver = get_driver()
+        for _ in range(runs):
+            history = [{"role": "user", "content": "Stream a long answer."}]
+            cpu = time.process_time()
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(devnull):
+                    cli.complete(driver, history, True, 0.7, "mock", "stream")
+            step = metrics.collector.steps[-1].to_dict()
+            step["cpu_seconds"] = time.process_time() - cpu
+            results.append(step)
+
+    return {
+        "ttft_seconds": statistics.median(step["ttft_seconds"] for step in results),
+        "duration_seconds": statistics.median(
+            step["duration_seconds"] for step in results
+        ),
+        "chunks_per_second": statistics.median(
+            step["chunks"] / step["duration_seconds"] for step in results
+        ),
+        "cpu_seconds": statistics.median(step["cpu_seconds"] for step in results),
+    }
+
+
+def bench_chain(runs: int) -> dict:
+    config = ServerConfig(latency=0.01, tokens=100)
+    with mock_environment(config) as environment:
+        timings = run_cli(
+            ["-m", MODEL, "--no-cache", "summarize", "summarize", "summarize"],
+            environment,
+            runs,
+        )
+    return summarize(timings)
+
+
+def bench_chat(runs: int, turns: int = 50) -> dict:
+    cli = load_cli()
+    config = ServerConfig(tokens=200, chunk_size=4)
+    timings = []
+    with mock_environment(config):
+        driver = get_driver()
+        for _ in range(runs):
+            history = [{"role": "system", "content": "You are a benchmark."}]
+            start = time.perf_counter()
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(devnull):
+                    for turn in range(turns):
+                        history.append({"role": "user", "content": f"Turn {turn}"})
+                        result = cli.complete(
+                            driver,
+                            history,
+                            True,
+                            0.7,
+                            "mock",
+                            "chat",
+                        )
+                        history.append({"role": "assistant", "content": result})
+            timings.append(time.perf_counter() - start)
+
+    result = summarize(timings)
+    result["turns"] = turns
+    return result
+
+
+def bench_retries(runs: int, requests: int = 20) -> dict:
+    config = ServerConfig(tokens=50, error_rate=0.3, error_status=429)
+    timings = []
+    failures = 0
+    with mock_environment(config):
+        driver = get_driver()
+        for _ in range(runs):
+            start = time.perf_counter()
+            for _ in range(requests):
+                history = [{"role": "user", "content": "Retry me."}]
+                _, error = driver.perform_request(history, False, 0.7, "mock")
+                if error is not None:
+                    failures += 1
+            timings.append(time.perf_counter() - start)
+
+    result = summarize(timings)
+    result["requests"] = requests
+    result["failures"] = failures
+    return result
+
+
+def make_samples(directory: str) -> dict:
+    paragraph = " ".join(["Benchmark text for the extractors."] * 20)
+    samples = {}
+
+    path = os.path.join(directory, "sample.txt")
+    with open(path, "w") as f:
+        f.write("\n\n".join([paragraph] * 2000))
+    samples["txt"] = path
+
+    path = os.path.join(directory, "sample.html")
+    with open(path, "w") as f:
+        f.write("<html><body><nav><a href='/'>Home</a></nav><article>")
+        for index in range(2000):
+            f.write(f"<h2>Section {index}</h2><p>{paragraph} <a href='#'>link</a></p>")
+        f.write("</article><footer>Footer</footer></body></html>")
+    samples["html"] = path
+
+    try:
+        import pymupdf
+    except ImportError:
+        return samples
+
+    path = os.path.join(directory, "sample.pdf")
+    doc = pymupdf.open()
+    for _ in range(50):
+        doc.new_page().insert_text((72, 72), paragraph[:80])
+    doc.save(path)
+    doc.close()
+    samples["pdf"] = path
+    return samples
+
+
+def bench_extract(runs: int) -> dict:
+    import extract
+
+    extract.cache_enabled = False
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in make_samples(directory).items():
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull:
+                    with contextlib.redirect_stderr(devnull):
+                        extract.extract_uncached(path)
+                timings.append(time.perf_counter() - start)
+            result[name + "_seconds"] = statistics.median(timings)
+    return result
+
+
+def bench_transcribe(runs: int, seconds: int = 300) -> dict:
+    import extract
+
+    # Some uploads fail, the client and the per segment retries recover
+    config = ServerConfig(latency=0.05, error_rate=0.2, error_status=429)
+    server, base_url = start_server_process(config)
+    expected = get_test_transcript(seconds)
+    cold = []
+    cached = []
+    correct = True
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "speech.wav")
+            write_test_audio(path, seconds)
+            environment = {
+                "OPENAI_BASE_URL": base_url,
+                "OPENAI_API_KEY": "bench",
+                "AI_TRANSCRIPTION_SEGMENT": "60",
+                "AI_TRANSCRIPTION_OVERLAP": "5",
+                "AI_TRANSCRIPTION_FORMAT": "wav",
+            }
+            for run in range(runs):
+                # A fresh cache per run, the second transcription is served
+                # from the per segment cache
+                environment["XDG_CACHE_HOME"] = os.path.join(directory, str(run))
+                with patched_environ(environment):
+                    extract.cache_enabled = True
+                    extract.extract_cache = None
+                    for timings in [cold, cached]:
+                        start = time.perf_counter()
+                        text = extract.from_audio(path)
+                        timings.append(time.perf_counter() - start)
+                        correct = correct and text == expected
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "cold_seconds": statistics.median(cold),
+        "cached_seconds": statistics.median(cached),
+        "correct": correct,
+    }
+
+
+SCENARIOS = {
+    "cold_start": bench_cold_start,
+    "stream": bench_stream,
+    "chain": bench_chain,
+    "chat": bench_chat,
+    "retries": bench_retries,
+    "extract": bench_extract,
+    "transcribe": bench_transcribe,
+}
+
+
+def get_commit() -> tuple:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=ROOT,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            cwd=ROOT,
+        ).stdout.strip()
+    except OSError:
+        return None, False
+    return commit or None, status != ""
+
+
+def read_history(path: str) -> list:
+    records = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip() != "":
+                    records.append(json.loads(line))
+    except (OSError, ValueError):
+        pass
+    return records
+
+
+def print_results(record: dict, previous: dict = None):
+    for scenario, values in record["results"].items():
+        print(f"{scenario}:")
+        before = (previous or {}).get("results", {}).get(scenario, {})
+        for name, value in values.items():
+            line = f"  {name}: {value:.4f}" if isinstance(value, float) else None
+            if line is None:
+                print(f"  {name}: {value}")
+                continue
+            old = before.get(name)
+            if isinstance(old, (int, float)) and old > 0:
+                line += f" ({(value - old) / old * 100:+.1f}%)"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure ai-cli overhead against a local stand-in server",
+    )
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="Only run these scenarios, can be repeated",
+    )
+    parser.add_argument(
+        "--history",
+        type=str,
+        default=DEFAULT_HISTORY,
+        help="JSONL file the results are appended to",
+    )
+    parser.add_argument(
+        "--no-history",
+        action="store_true",
+        help="Do not append the results to the history",
+    )
+    args = parser.parse_args()
+
+    commit, dirty = get_commit()
+    record = {
+        "timestamp": time.time(),
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "results": {},
+    }
+
+    for scenario in args.scenario or list(SCENARIOS):
+        sys.stderr.write(f"Running {scenario}\n")
+        record["results"][scenario] = SCENARIOS[scenario](args.runs)
+
+    # Compare against the latest run of another commit
+    history = read_history(args.history)
+    previous = None
+    for entry in reversed(history):
+        if entry.get("commit") != commit or entry.get("dirty") != dirty:
+            previous = entry
+            break
+    if previous is not None:
+        print(f"Compared to {(previous.get('commit') or 'unknown')[:12]}")
+    print_results(record, previous)
+
+    if not args.no_history:
+        with open(args.history, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def count_imports(command: list[str]) -> set[str]:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command,
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+    modules = set()
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def measure(command: list[str], runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            cwd=ROOT,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the cold start of ai-cli against a budget",
+    )
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    parser.add_argument(
+        "--max-time",
+        type=float,
+        default=0.1,
+        help="Allowed median overhead in seconds over a bare interpreter",
+    )
+    parser.add_argument(
+        "--max-imports",
+        type=int,
+        default=25,
+        help="Allowed number of modules imported on top of a bare interpreter",
+    )
+    parser.add_argument(
+        "args",
+        nargs="*",
+        default=["-l"],
+        help="Arguments passed to ai-cli.py",
+    )
+    args = parser.parse_args()
+
+    command = ["ai-cli.py"] + args.args
+
+    baseline = statistics.median(measure(["-c", "pass"], args.runs))
+    median = statistics.median(measure(command, args.runs))
+    overhead = median - baseline
+
+    imports = count_imports(command) - count_imports(["-c", "pass"])
+
+    print(f"Interpreter: {baseline * 1000:.1f} ms")
+    print(f"ai-cli {' '.join(args.args)}: {median * 1000:.1f} ms")
+    print(f"Overhead: {overhead * 1000:.1f} ms (budget {args.max_time * 1000:.0f} ms)")
+    print(f"Extra imports: {len(imports)} (budget {args.max_imports})")
+
+    failed = False
+    if overhead > args.max_time:
+        sys.stderr.write("Startup time budget exceeded\n")
+        failed = True
+    if len(imports) > args.max_imports:
+        sys.stderr.write("Import budget exceeded: " + ", ".join(sorted(imports)) + "\n")
+        failed = True
+
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import re
+from typing import Optional
+
+BOILERPLATE_TAGS = [
+    "aside",
+    "button",
+    "footer",
+    "form",
+    "header",
+    "iframe",
+    "nav",
+    "noscript",
+    "svg",
+]
+BOILERPLATE_PATTERN = re.compile(
+    r"(^|[\W_])(ad|ads|advert\w*|banner|breadcrumbs?|comments?|cookies?|footer"
+    r"|header|masthead|menu|modal|nav\w*|newsletter|popup|promo\w*|related"
+    r"|share|sharing|sidebar|social|sponsor\w*|subscribe|toolbar)([\W_]|$)",
+    re.IGNORECASE,
+)
+MAIN_CONTENT_SELECTORS = ["main", "article", "[role=main]"]
+CANDIDATE_TAGS = ["article", "div", "section", "td"]
+MIN_MAIN_CONTENT_LENGTH = 200
+
+html_parser = None
+
+
+def get_parser() -> str:
+    global html_parser
+
+    if html_parser is None:
+        # lxml is a lot faster than the pure Python parser on large pages
+        try:
+            import lxml  # noqa: F401
+
+            html_parser = "lxml"
+        except ImportError:
+            html_parser = "html.parser"
+
+    return html_parser
+
+
+def is_boilerplate(tag) -> bool:
+    if tag.attrs is None:
+        return False
+    names = " ".join(tag.get("class") or []) + " " + (tag.get("id") or "")
+    if BOILERPLATE_PATTERN.search(names) is not None:
+        return True
+    return tag.get("role") in ["navigation", "banner", "contentinfo", "complementary"]
+
+
+def get_text_length(tag) -> int:
+    return len(tag.get_text(" ", strip=True))
+
+
+def get_link_density(tag, length: int) -> float:
+    if length == 0:
+        return 1.0
+    links = sum(get_text_length(link) for link in tag.find_all("a"))
+    return links / length
+
+
+def remove_boilerplate(soup):
+    for tag in soup(BOILERPLATE_TAGS):
+        tag.decompose()
+
+    # Collect first, decomposing while iterating would skip elements
+    for tag in [tag for tag in soup.find_all(True) if is_boilerplate(tag)]:
+        if tag.name not in ["html", "body"] and not tag.decomposed:
+            tag.decompose()
+
+
+def find_main_content(soup) -> Optional[object]:
+    for selector in MAIN_CONTENT_SELECTORS:
+        candidates = soup.select(selector)
+        if len(candidates) == 1:
+            if get_text_length(candidates[0]) >= MIN_MAIN_CONTENT_LENGTH:
+                return candidates[0]
+
+    # Otherwise pick the block whose own paragraphs hold the most text that
+    # is not link text
+    best = None
+    best_score = 0.0
+    for tag in soup.find_all(CANDIDATE_TAGS):
+        paragraphs = tag.find_all("p", recursive=False)
+        if len(paragraphs) == 0:
+            continue
+        length = sum(get_text_length(paragraph) for paragraph in paragraphs)
+        score = length * (1.0 - get_link_density(tag, get_text_length(tag)))
+        if score > best_score:
+            best = tag
+            best_score = score
+
+    if best is None or best_score < MIN_MAIN_CONTENT_LENGTH:
+        return None
+    return best
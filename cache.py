@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any
+from typing import Optional
+
+import ai
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+EVICT_INTERVAL = 100
+# Processes share one sweep per period, recorded by the stamp file's mtime
+EVICT_PERIOD = 10 * 60
+EVICT_STAMP = ".evicted"
+
+
+def make_key(*parts) -> str:
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    def __init__(
+        self,
+        path: str,
+        max_size: Optional[int] = DEFAULT_MAX_SIZE,
+        max_age: Optional[float] = DEFAULT_MAX_AGE,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key: str) -> str:
+        return self.path + "/" + key[:2] + "/" + key + ".json"
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._entry_path(key)
+        try:
+            mtime = os.path.getmtime(path)
+            if self.max_age is not None and time.time() - mtime > self.max_age:
+                os.remove(path)
+                self._count(False)
+                return None
+            with open(path, "r") as f:
+                value = json.load(f)
+            # Touch the entry so eviction drops the least recently used first
+            os.utime(path)
+        except (OSError, ValueError):
+            self._count(False)
+            return None
+
+        self._count(True)
+        return value
+
+    def put(self, key: str, value: Any):
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+
+        with self._lock:
+            self._puts += 1
+            should_check = self._puts % EVICT_INTERVAL == 1
+        if should_check and self._claim_eviction():
+            self.evict()
+
+    def _claim_eviction(self) -> bool:
+        stamp = self.path + "/" + EVICT_STAMP
+        try:
+            if time.time() - os.path.getmtime(stamp) < EVICT_PERIOD:
+                return False
+        except OSError:
+            pass
+
+        try:
+            with open(stamp, "a"):
+                pass
+            os.utime(stamp)
+        except OSError:
+            return False
+        return True
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                age = now - stat.st_mtime
+                expired = self.max_age is not None and age > self.max_age
+                # Leftovers of interrupted writes
+                if name.endswith(".tmp") and age > 60 * 60:
+                    expired = True
+                if expired:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                if name.endswith(".json"):
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total_size += stat.st_size
+
+        if self.max_size is None:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+
+def get_int_env(name: str, defval: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return defval
+    return int(value)
+
+
+def open_cache(name: str) -> Optional[DiskCache]:
+    cache_dir = ai.get_cache_dir()
+    if cache_dir is None:
+        return None
+
+    return DiskCache(
+        cache_dir + "/" + name,
+        get_int_env("AI_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE),
+        get_int_env("AI_CACHE_MAX_AGE", DEFAULT_MAX_AGE),
+    )
+
+
+def replay_completion(content: str):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+async def replay_stream(content: str):
+    delta = SimpleNamespace(content=content)
+    yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+class CachedDriver:
+    def __init__(
+        self,
+        driver,
+        cache: DiskCache,
+        refresh: bool = False,
+        scope: Any = None,
+    ):
+        self.driver = driver
+        self.cache = cache
+        self.refresh = refresh
+        # Identifies the backends, the same model name can be served by
+        # different providers
+        self.scope = scope
+
+    async def close(self):
+        await self.driver.close()
+
+    async def perform_request(
+        self,
+        history: list,
+        is_stream: bool,
+        temperature: float = 0.7,
+        model: Optional[str] = None,
+    ):
+        key = make_key(self.scope, model, history, temperature)
+
+        if not self.refresh:
+            entry = self.cache.get(key)
+            if entry is not None:
+                if is_stream:
+                    return replay_stream(entry["content"]), None
+                return replay_completion(entry["content"]), None
+
+        completion, error = await self.driver.perform_request(
+            history,
+            is_stream,
+            temperature,
+            model,
+        )
+        if error is not None:
+            return None, error
+
+        if is_stream:
+            return self._record_stream(key, completion), None
+
+        self.cache.put(key, {"content": completion.choices[0].message.content})
+        return completion, None
+
+    async def _record_stream(self, key: str, completion):
+        from driver_openai import close_completion
+
+        parts = []
+        try:
+            async for chunk in completion:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                yield chunk
+        finally:
+            await close_completion(completion)
+
+        self.cache.put(key, {"content": "".join(parts)})
@@ -0,0 +1,177 @@
+import asyncio
+import re
+from typing import Optional
+from typing import Tuple
+
+import ai
+
+PAGE_SEPARATOR = "\f"
+CHUNK_SEPARATOR = "\n\n---\n\n"
+MAX_REDUCE_ROUNDS = 8
+
+
+def split_block(block: str, max_tokens: int) -> list[str]:
+    if ai.estimate_tokens(block) <= max_tokens:
+        return [block]
+
+    lines = block.split("\n")
+    if len(lines) > 1:
+        return pack_blocks(lines, max_tokens, "\n")
+
+    # A single huge line, fall back to a hard split on characters
+    size = max(1, max_tokens * 4)
+    return [block[index : index + size] for index in range(0, len(block), size)]
+
+
+def pack_blocks(blocks: list[str], max_tokens: int, separator: str) -> list[str]:
+    chunks = []
+    current = []
+    used = 0
+    for block in blocks:
+        for part in split_block(block, max_tokens):
+            cost = ai.estimate_tokens(part)
+            if len(current) > 0 and used + cost > max_tokens:
+                chunks.append(separator.join(current))
+                current = []
+                used = 0
+            current.append(part)
+            used += cost
+    if len(current) > 0:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_text(text: str, max_tokens: int, overlap_tokens: int = 0) -> list[str]:
+    blocks = []
+    for page in text.split(PAGE_SEPARATOR):
+        for paragraph in re.split(r"\n\s*\n", page):
+            if paragraph.strip() != "":
+                blocks.append(paragraph)
+
+    chunks = pack_blocks(blocks, max(1, max_tokens - overlap_tokens), "\n\n")
+
+    if overlap_tokens <= 0 or len(chunks) < 2:
+        return chunks
+
+    result = [chunks[0]]
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Repeat the tail of the previous chunk, cut on a paragraph boundary
+        # where possible, so context spanning the boundary is not lost
+        overlap = []
+        used = 0
+        for paragraph in reversed(previous.split("\n\n")):
+            cost = ai.estimate_tokens(paragraph)
+            if used + cost > overlap_tokens:
+                break
+            overlap.insert(0, paragraph)
+            used += cost
+        if len(overlap) == 0:
+            overlap = [previous[-overlap_tokens * 4 :]]
+        result.append("\n\n".join(overlap + [chunk]))
+    return result
+
+
+async def map_chunks(
+    driver,
+    patterns: list[str],
+    chunks: list[str],
+    system_input: str,
+    temperature: float,
+    model: Optional[str],
+    jobs: int,
+) -> Tuple[Optional[list[str]], Optional[str]]:
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def apply(index: int, chunk: str):
+        async with semaphore:
+            try:
+                result, error = await ai.run_patterns_async(
+                    driver,
+                    patterns,
+                    chunk,
+                    system_input,
+                    temperature,
+                    model,
+                )
+            except Exception as e:
+                result, error = None, f"{type(e).__name__}: {e}"
+            return index, result, error
+
+    tasks = [
+        asyncio.create_task(apply(index, chunk)) for index, chunk in enumerate(chunks)
+    ]
+    results = [None] * len(chunks)
+    try:
+        for task in asyncio.as_completed(tasks):
+            index, result, error = await task
+            if error is not None:
+                return None, f"Chunk {index + 1} failed: {error}"
+            results[index] = result
+    finally:
+        # One failed chunk fails the run, the others are not needed anymore
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return results, None
+
+
+async def run_map_reduce(
+    driver,
+    patterns: list[str],
+    reduce_patterns: list[str],
+    text: str,
+    max_tokens: int,
+    overlap_tokens: int = 0,
+    system_input: str = "",
+    temperature: float = 0.7,
+    model: Optional[str] = None,
+    jobs: int = 4,
+) -> Tuple[Optional[str], Optional[str]]:
+    chunks = split_text(text, max_tokens, overlap_tokens)
+    if len(chunks) == 0:
+        return None, "No input to process"
+
+    partials, error = await map_chunks(
+        driver,
+        patterns,
+        chunks,
+        system_input,
+        temperature,
+        model,
+        jobs,
+    )
+    if error is not None:
+        return None, error
+
+    # Partial results that still do not fit are reduced in several rounds
+    reduced = len(chunks) == 1
+    for _ in range(MAX_REDUCE_ROUNDS):
+        if len(partials) == 1:
+            break
+        if ai.estimate_tokens(CHUNK_SEPARATOR.join(partials)) <= max_tokens:
+            break
+        groups = pack_blocks(partials, max_tokens, CHUNK_SEPARATOR)
+        partials, error = await map_chunks(
+            driver,
+            reduce_patterns,
+            groups,
+            "",
+            temperature,
+            model,
+            jobs,
+        )
+        if error is not None:
+            return None, error
+        reduced = True
+
+    if len(partials) == 1 and reduced:
+        return partials[0], None
+
+    return await ai.run_patterns_async(
+        driver,
+        reduce_patterns,
+        CHUNK_SEPARATOR.join(partials),
+        "",
+        temperature,
+        model,
+    )
@@ -0,0 +1,165 @@
+import threading
+from typing import Optional
+
+import ai
+
+DEFAULT_OUTPUT_RESERVE = 4096
+MESSAGE_OVERHEAD = 4
+SUMMARY_PATTERN = "compact_context"
+SUMMARY_TEMPERATURE = 0.2
+
+
+def count_message_tokens(message: dict) -> int:
+    return ai.estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+def get_budget(
+    context_window: Optional[int],
+    max_output_tokens: Optional[int] = None,
+) -> Optional[int]:
+    if context_window is None:
+        return None
+
+    reserve = max_output_tokens or DEFAULT_OUTPUT_RESERVE
+    # Never reserve more than half of the window for the answer
+    return context_window - min(reserve, context_window // 2)
+
+
+class ContextWindow:
+    def __init__(self, budget: int, strategy: str = "pinned"):
+        self.budget = budget
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._summary = None
+        self._summary_end = 0
+        self._summarizer = None
+
+    def fit(self, history: list, driver=None, model: Optional[str] = None) -> list:
+        if self.strategy == "none":
+            return history
+
+        costs = [count_message_tokens(message) for message in history]
+        if sum(costs) <= self.budget:
+            return history
+
+        pinned = None
+        if self.strategy in ["pinned", "summarize"]:
+            for index in range(len(history) - 1, -1, -1):
+                if history[index]["role"] == "system":
+                    pinned = index
+                    break
+
+        summary = None
+        with self._lock:
+            if self.strategy == "summarize" and self._summary is not None:
+                summary = {
+                    "role": "system",
+                    "content": "Summary of the earlier conversation:\n" + self._summary,
+                }
+
+        used = 0
+        if pinned is not None:
+            used += costs[pinned]
+        if summary is not None:
+            used += count_message_tokens(summary)
+
+        kept = []
+        for index in range(len(history) - 1, -1, -1):
+            if index == pinned:
+                continue
+            # The newest message is always sent, even if it is too large
+            if len(kept) > 0 and used + costs[index] > self.budget:
+                break
+            kept.append(index)
+            used += costs[index]
+
+        start = min(kept) if len(kept) > 0 else len(history)
+        if pinned is not None:
+            kept.append(pinned)
+        kept.sort()
+
+        if self.strategy == "summarize" and driver is not None:
+            self._summarize_async(history, start, pinned, driver, model)
+
+        payload = [history[index] for index in kept]
+        if summary is not None:
+            position = 1 if pinned is not None and pinned < start else 0
+            payload.insert(position, summary)
+        return payload
+
+    def _summarize_async(
+        self,
+        history: list,
+        end: int,
+        pinned: Optional[int],
+        driver,
+        model: Optional[str],
+    ):
+        with self._lock:
+            if end <= self._summary_end:
+                return
+            if self._summarizer is not None and self._summarizer.is_alive():
+                return
+
+            messages = [
+                message
+                for index, message in enumerate(history[self._summary_end : end])
+                if index + self._summary_end != pinned and message["role"] != "system"
+            ]
+            previous = self._summary
+
+            self._summarizer = threading.Thread(
+                target=self._summarize,
+                args=(messages, previous, end, driver, model),
+                daemon=True,
+            )
+            self._summarizer.start()
+
+    def _summarize(
+        self,
+        messages: list,
+        previous: Optional[str],
+        end: int,
+        driver,
+        model: Optional[str],
+    ):
+        transcript = "\n\n".join(
+            message["role"].upper() + ":\n" + message["content"] for message in messages
+        )
+        if previous is not None:
+            transcript = "PREVIOUS SUMMARY:\n" + previous + "\n\n" + transcript
+
+        summary, error = ai.run_patterns(
+            driver,
+            [SUMMARY_PATTERN],
+            transcript,
+            "",
+            SUMMARY_TEMPERATURE,
+            model,
+        )
+        if error is not None:
+            return
+
+        with self._lock:
+            self._summary = summary
+            self._summary_end = end
+
+
+class ContextDriver:
+    def __init__(self, driver, window: ContextWindow):
+        self.driver = driver
+        self.window = window
+
+    def perform_request(
+        self,
+        history: list,
+        is_stream: bool,
+        temperature: float = 0.7,
+        model: Optional[str] = None,
+    ):
+        return self.driver.perform_request(
+            self.window.fit(history, self.driver, model),
+            is_stream,
+            temperature,
+            model,
+        )
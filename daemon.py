@@ -0,0 +1,231 @@
+import io
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+from typing import Optional
+
+STDOUT = b"1"
+STDERR = b"2"
+EXIT = b"x"
+HEADER = struct.Struct("!cI")
+
+# Arguments that need a terminal or a long running process of their own
+LOCAL_ARGUMENTS = ["-c", "--chat", "-r", "--resume", "--daemon"]
+
+
+# Environment variables a request may read, nothing else is forwarded
+FORWARDED_PREFIXES = ["AI_", "OPENAI_", "XDG_", "LC_"]
+FORWARDED_VARIABLES = [
+    "DEFAULT_AI_MODEL",
+    "YOUTUBE_API_KEY",
+    "HOME",
+    "LOCALAPPDATA",
+    "TMP",
+    "TEMP",
+    "TMPDIR",
+    "PATH",
+    "LANG",
+    "TERM",
+    "NO_COLOR",
+    "SSL_CERT_FILE",
+    "SSL_CERT_DIR",
+]
+
+
+def filter_environment(environment: dict, names: list[str]) -> dict:
+    # Provider tokens are read from the variables models.json names
+    return {
+        name: value
+        for name, value in environment.items()
+        if name in FORWARDED_VARIABLES
+        or name in names
+        or name.lower().endswith("_proxy")
+        or any(name.startswith(prefix) for prefix in FORWARDED_PREFIXES)
+    }
+
+
+def check_directory(directory: str) -> Optional[str]:
+    # Without XDG_RUNTIME_DIR the socket lives in /tmp, where another user
+    # could create the directory first and receive every request
+    try:
+        info = os.lstat(directory)
+    except OSError as e:
+        return f"Cannot access {directory}: {e.strerror}"
+    if not stat.S_ISDIR(info.st_mode):
+        return f"{directory} is not a directory"
+    if info.st_uid != os.getuid():
+        return f"{directory} is owned by another user"
+    if stat.S_IMODE(info.st_mode) != 0o700:
+        return f"{directory} must only be accessible by its owner (mode 0700)"
+    return None
+
+
+def get_peer_uid(connection: socket.socket) -> Optional[int]:
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = connection.getsockopt(
+        socket.SOL_SOCKET,
+        socket.SO_PEERCRED,
+        struct.calcsize("3i"),
+    )
+    _, uid, _ = struct.unpack("3i", credentials)
+    return uid
+
+
+def get_socket_path() -> str:
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        directory = runtime_dir + "/ai-cli"
+    else:
+        directory = f"/tmp/ai-cli-{os.getuid()}"
+    return directory + "/daemon.sock"
+
+
+def read_exactly(connection: socket.socket, size: int) -> Optional[bytes]:
+    data = b""
+    while len(data) < size:
+        part = connection.recv(size - len(data))
+        if not part:
+            return None
+        data += part
+    return data
+
+
+def send_frame(connection: socket.socket, kind: bytes, payload: bytes):
+    connection.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+class FrameWriter(io.TextIOBase):
+    def __init__(self, connection: socket.socket, kind: bytes, is_tty: bool):
+        self.connection = connection
+        self.kind = kind
+        self.is_tty = is_tty
+
+    @property
+    def encoding(self) -> str:
+        return "utf-8"
+
+    def isatty(self) -> bool:
+        return self.is_tty
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if len(text) > 0:
+            send_frame(self.connection, self.kind, text.encode("utf-8"))
+        return len(text)
+
+
+class RequestInput(io.TextIOWrapper):
+    def __init__(self, buffer, is_tty: bool):
+        super().__init__(buffer, encoding="utf-8", errors="replace")
+        self.is_tty = is_tty
+
+    def isatty(self) -> bool:
+        return self.is_tty
+
+
+def handle_connection(connection: socket.socket, handler):
+    # Input is read lazily, a command that never reads it does not wait for it
+    reader = connection.makefile("rb")
+    header = json.loads(reader.readline())
+    stdin = RequestInput(reader, header.get("stdin_isatty", False))
+    stdout = FrameWriter(connection, STDOUT, header.get("stdout_isatty", False))
+    stderr = FrameWriter(connection, STDERR, header.get("stderr_isatty", False))
+
+    # The request runs with the client's working directory and environment
+    saved_cwd = os.getcwd()
+    saved_environ = dict(os.environ)
+    try:
+        os.chdir(header["cwd"])
+        os.environ.clear()
+        os.environ.update(header.get("env", {}))
+        code = handler(header["argv"], stdin, stdout, stderr)
+    finally:
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        stdin.close()
+
+    send_frame(connection, EXIT, str(code).encode("ascii"))
+
+
+def open_listener(path: str) -> (Optional[socket.socket], Optional[str]):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    error = check_directory(directory)
+    if error is not None:
+        return None, error
+
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            return None, f"A daemon is already listening on {path}"
+        except OSError:
+            # Left behind by a daemon that did not shut down cleanly
+            os.unlink(path)
+        finally:
+            probe.close()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    previous = os.umask(0o177)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(previous)
+    listener.listen(16)
+    return listener, None
+
+
+def serve(handler, idle_timeout: float, path: Optional[str] = None):
+    path = path or get_socket_path()
+    listener, error = open_listener(path)
+    if error is not None:
+        sys.stderr.write(f"Error: {error}\n")
+        return
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    sys.stderr.write(f"Listening on {path}\n")
+
+    listener.settimeout(idle_timeout if idle_timeout > 0 else None)
+    try:
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except socket.timeout:
+                sys.stderr.write("Idle timeout reached, shutting down\n")
+                break
+
+            uid = get_peer_uid(connection)
+            if uid is not None and uid != os.getuid():
+                sys.stderr.write(f"Refused a connection from user {uid}\n")
+                connection.close()
+                continue
+
+            # Requests share module state, so they are handled one at a time,
+            # parallel clients (for example from xargs -P) wait for each other
+            connection.settimeout(None)
+            try:
+                handle_connection(connection, handler)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client went away, for example after Ctrl-C
+                pass
+            except Exception as e:
+                sys.stderr.write(f"Request failed: {type(e).__name__}: {e}\n")
+            finally:
+                connection.close()
+    finally:
+        listener.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
@@ -1,40 +1,154 @@
+import asyncio
+import os
 from typing import Any
 from typing import Optional
 from typing import Tuple
 
-from openai import NotFoundError
+import metrics
 
 
-class OpenAIDriver:
-    def __init__(self, base_address, token):
-        self.base_address = base_address
-        self.token = token
-        self._client = None
+def create_client(
+    base_address: Optional[str],
+    token: str,
+    timeout: Optional[float] = None,
+    max_connections: Optional[int] = None,
+    is_async: bool = False,
+) -> Tuple[Any, Optional[str]]:
+    import httpx
+    from openai import AsyncOpenAI
+    from openai import DefaultAsyncHttpxClient
+    from openai import DefaultHttpxClient
+    from openai import OpenAI
 
-    def get_client(self) -> Tuple[Any, Optional[str]]:
-        from openai import OpenAI
+    if timeout is None and os.getenv("AI_HTTP_TIMEOUT"):
+        timeout = float(os.getenv("AI_HTTP_TIMEOUT", ""))
+    if max_connections is None and os.getenv("AI_HTTP_MAX_CONNECTIONS"):
+        max_connections = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", ""))
 
-        global _client
+    http_options = {}
+    client_options = {}
+    if timeout is not None:
+        http_options["timeout"] = timeout
+        client_options["timeout"] = timeout
+    if max_connections is not None:
+        http_options["limits"] = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
 
-        try:
-            self._client = OpenAI(
-                base_url=self.base_address,
-                api_key=self.token,
-            )
-        except Exception as e:
-            return None, f"Failed to create OpenAI client: {e}"
+    if is_async:
+        client_class, http_client_class = AsyncOpenAI, DefaultAsyncHttpxClient
+    else:
+        client_class, http_client_class = OpenAI, DefaultHttpxClient
+
+    try:
+        client = client_class(
+            base_url=base_address,
+            api_key=token,
+            http_client=http_client_class(**http_options),
+            **client_options,
+        )
+    except Exception as e:
+        return None, f"Failed to create OpenAI client: {e}"
+
+    return client, None
+
+
+RESUME_PROMPT = (
+    "Your previous answer was cut off. Continue exactly where it stopped, "
+    "without repeating any of it."
+)
+
+
+def get_error_message(e) -> str:
+    body = getattr(e, "body", None)
+    if isinstance(body, dict) and "message" in body:
+        return body["message"]
+    return str(e)
+
+
+def classify_error(e) -> Tuple[str, bool, Optional[float]]:
+    from openai import APIConnectionError
+    from openai import APIStatusError
+    from openai import AuthenticationError
+    from openai import InternalServerError
+    from openai import NotFoundError
+    from openai import RateLimitError
+    from ratelimit import get_retry_after
+
+    retry_after = None
+    if isinstance(e, APIStatusError):
+        retry_after = get_retry_after(e.response.headers)
+
+    if isinstance(e, AuthenticationError):
+        return "Failed to authenticate to server: " + get_error_message(e), False, None
+    if isinstance(e, NotFoundError):
+        return "Not found: " + get_error_message(e), False, None
+    if isinstance(e, RateLimitError):
+        return "API rate limit exceeded: " + get_error_message(e), True, retry_after
+    if isinstance(e, InternalServerError):
+        return "Server error: " + get_error_message(e), True, retry_after
+    if isinstance(e, APIConnectionError):
+        return "Connection failed: " + get_error_message(e), True, None
+    if isinstance(e, APIStatusError):
+        # Other client errors, such as an exceeded context length, will not
+        # succeed on another attempt
+        message = f"Request failed with status {e.status_code}: "
+        return message + get_error_message(e), False, None
+    raise e
+
+
+def count_request_tokens(history: list) -> int:
+    from ai import estimate_tokens
+
+    return sum(estimate_tokens(message["content"]) for message in history)
+
+
+def get_request_options(is_stream: bool) -> dict:
+    # Usage of streamed answers is only reported when asked for, and not every
+    # compatible server knows the option, so it is only sent for --stats
+    if is_stream and metrics.is_enabled():
+        return {"stream_options": {"include_usage": True}}
+    return {}
+
+
+def get_resume_history(history: list, partial: str) -> list:
+    if partial == "":
+        return history
+    return history + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": RESUME_PROMPT},
+    ]
+
+
+def is_resumable_error(e) -> bool:
+    import httpx
+    from openai import APIError
+
+    return isinstance(e, (APIError, httpx.HTTPError))
+
+
+class OpenAIDriver:
+    def __init__(self, client, limiter=None, retry_policy=None):
+        from ratelimit import RetryPolicy
 
+        self._client = client
+        self.limiter = limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    def get_client(self) -> Tuple[Any, Optional[str]]:
         return self._client, None
 
-    def perform_request(
+    async def close(self):
+        await self._client.close()
+
+    async def perform_request(
         self,
         history: list,
         is_stream: bool,
         temperature: float = 0.7,
         model: Optional[str] = None,
     ):
-        from openai import AuthenticationError, RateLimitError
-
         client, error = self.get_client()
         if error:
             return None, error
@@ -42,18 +156,124 @@ class OpenAIDriver:
         if model is None:
             return None, "No model defined"
 
-        try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=history,
-                temperature=temperature,
-                stream=is_stream,
+        completion, error = await self.create(
+            client,
+            history,
+            is_stream,
+            temperature,
+            model,
+        )
+        if error is not None or not is_stream:
+            return completion, error
+
+        return ResumableStream(self, completion, history, temperature, model), None
+
+    async def create(
+        self,
+        client,
+        history: list,
+        is_stream: bool,
+        temperature: float,
+        model: str,
+    ):
+        client = client.with_options(max_retries=0)
+        options = get_request_options(is_stream)
+        step = metrics.get_current_step()
+        error = None
+        for attempt in range(self.retry_policy.max_retries + 1):
+            if self.limiter is not None:
+                await self.limiter.acquire_async(count_request_tokens(history))
+            if step is not None:
+                step.record_attempt()
+
+            try:
+                completion = await client.chat.completions.create(
+                    model=model,
+                    messages=history,
+                    temperature=temperature,
+                    stream=is_stream,
+                    **options,
+                )
+
+                return completion, None
+            except Exception as e:
+                error, retryable, retry_after = classify_error(e)
+
+            if not retryable or attempt == self.retry_policy.max_retries:
+                break
+
+            delay = self.retry_policy.get_delay(attempt, retry_after)
+            if self.limiter is not None and retry_after is not None:
+                self.limiter.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+
+        return None, error
+
+
+class ResumableStream:
+    def __init__(self, driver, completion, history, temperature, model):
+        self.driver = driver
+        self.completion = completion
+        self.history = history
+        self.temperature = temperature
+        self.model = model
+
+    async def __aiter__(self):
+        parts = []
+        resumes = 0
+        while True:
+            try:
+                async for chunk in self.completion:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                    yield chunk
+                return
+            except Exception as e:
+                if not is_resumable_error(e):
+                    raise
+                if resumes >= self.driver.retry_policy.max_retries:
+                    raise
+                await self.close()
+
+            await asyncio.sleep(self.driver.retry_policy.get_delay(resumes))
+            resumes += 1
+
+            client, _ = self.driver.get_client()
+            completion, error = await self.driver.create(
+                client,
+                get_resume_history(self.history, "".join(parts)),
+                True,
+                self.temperature,
+                self.model,
             )
+            if error is not None:
+                raise RuntimeError(error)
+            self.completion = completion
+
+    async def close(self):
+        try:
+            await close_completion(self.completion)
+        except Exception:
+            pass
+
+
+async def close_completion(completion):
+    if hasattr(completion, "aclose"):
+        await completion.aclose()
+    elif hasattr(completion, "close"):
+        await completion.close()
+
+
+async def iter_completion(completion, is_stream: bool):
+    if not is_stream:
+        yield completion.choices[0].message.content
+        return
 
-            return completion, None
-        except AuthenticationError as e:
-            return None, "Failed to authenticate to server: " + e.body["message"]
-        except RateLimitError as e:
-            return None, "API rate limit exceeded: " + e.body["message"]
-        except NotFoundError as e:
-            return None, "Not found: " + e.body["message"]
+    try:
+        async for chunk in completion:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Runs on cancellation as well, releasing the connection immediately
+        await close_completion(completion)
@@ -1,22 +1,41 @@
 #!/usr/bin/env python
+import argparse
+import glob
+import hashlib
+import importlib
+import json
 import os
 import re
 import sys
-import urllib.request
+import time
+from collections import deque
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Iterator
 from typing import Optional
 
-import docx
-import dotenv
-import isodate
-import pymupdf
-from bs4 import BeautifulSoup
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from markdownify import MarkdownConverter
-from youtube_transcript_api import YouTubeTranscriptApi
-
+from ai import estimate_tokens
 from ai import get_client
 
+EXTRACTOR_VERSION = 1
+PAGE_SEPARATOR = "\f"
+PDF_PAGES_PER_TASK = 8
+
+cache_enabled = True
+extract_cache = None
+http_fetcher = None
+http_timeout = 30.0
+http_max_bytes = 10 * 1024 * 1024
+pdf_workers = None
+main_content_only = False
+
+# Extractors are tried in order, the first one whose predicate accepts the
+# path is used. Each entry is (name, predicate, function, cpu_bound).
+extractors = []
+plugins_loaded = False
+
 
 def get_video_id(url) -> Optional[str]:
     # Extract video ID from URL
@@ -38,11 +57,83 @@ def from_txt(filename: str) -> Optional[str]:
         return f.read()
 
 
-def from_pdf(filename) -> Optional[str]:
+def parse_page_ranges(spec: str, page_count: int) -> list[int]:
+    # Pages are given 1-based, for example "1-5,8,10-"
+    pages = []
+    for part in spec.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            first = int(start) if start.strip() else 1
+            last = int(end) if end.strip() else page_count
+        else:
+            first = last = int(part)
+        for number in range(max(1, first), min(last, page_count) + 1):
+            pages.append(number - 1)
+    return pages
+
+
+def extract_pdf_pages(filename: str, pages: list[int]) -> list[str]:
+    import pymupdf
+
+    doc = pymupdf.open(filename)
+    try:
+        return [doc[number].get_text() for number in pages]
+    finally:
+        doc.close()
+
+
+def iter_pdf_pages(
+    filename: str,
+    pages: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> Iterator[str]:
+    import pymupdf
+
+    doc = pymupdf.open(filename)
+    page_count = doc.page_count
+    doc.close()
+
+    if pages is None:
+        page_numbers = list(range(page_count))
+    else:
+        page_numbers = parse_page_ranges(pages, page_count)
+
+    batches = [
+        page_numbers[index : index + PDF_PAGES_PER_TASK]
+        for index in range(0, len(page_numbers), PDF_PAGES_PER_TASK)
+    ]
+
+    workers = workers or pdf_workers or os.cpu_count() or 1
+    if workers <= 1 or len(batches) <= 1:
+        for batch in batches:
+            yield from extract_pdf_pages(filename, batch)
+        return
+
+    # Batches are submitted ahead of time but only a bounded number is kept
+    # in flight, and results are yielded in page order as they become ready
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        next_batch = 0
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) < workers * 2:
+                pending.append(
+                    executor.submit(extract_pdf_pages, filename, batches[next_batch]),
+                )
+                next_batch += 1
+            yield from pending.popleft().result()
+
+
+def from_pdf(
+    filename,
+    pages: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> Optional[str]:
     if not file_exists(filename):
         return None
-    doc = pymupdf.open(filename)
-    return "\n".join([page.get_text() for page in doc])
+    return PAGE_SEPARATOR.join(iter_pdf_pages(filename, pages, workers))
 
 
 def from_doc(filename) -> Optional[str]:
@@ -63,6 +154,8 @@ def from_doc(filename) -> Optional[str]:
 def from_docx(filename) -> Optional[str]:
     if not file_exists(filename):
         return None
+    import docx
+
     doc = docx.Document(filename)
     fullText = []
     for para in doc.paragraphs:
@@ -71,27 +164,92 @@ def from_docx(filename) -> Optional[str]:
 
 
 def from_html(file: str) -> Optional[str]:
+    import boilerplate
+    from bs4 import BeautifulSoup
+    from markdownify import MarkdownConverter
+
     if file_exists(file):
         html = from_txt(file)
     else:
         html = file
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, boilerplate.get_parser())
     for tag in soup(["style", "script"]):
         tag.decompose()
 
-    return MarkdownConverter().convert_soup(soup)
+    if not main_content_only:
+        return MarkdownConverter().convert_soup(soup)
+
+    before = estimate_tokens(soup.get_text(" ", strip=True))
+    boilerplate.remove_boilerplate(soup)
+    content = boilerplate.find_main_content(soup) or soup
+    # Link targets and images are clutter once only the main text is kept
+    result = MarkdownConverter(strip=["a", "img"]).convert_soup(content)
+
+    after = estimate_tokens(result)
+    if before > after:
+        saved = before - after
+        sys.stderr.write(
+            f"Info: Main content is {after} tokens, "
+            f"saved {saved} tokens ({saved * 100 // before}%)\n",
+        )
+    return result
+
+
+def get_fetcher():
+    global http_fetcher
+
+    if http_fetcher is None:
+        import fetch
+
+        http_fetcher = fetch.HttpFetcher(http_timeout, http_max_bytes)
+
+    return http_fetcher
 
 
 def from_http(address) -> Optional[str]:
-    req = urllib.request.Request(address, headers={"User-Agent": "AI-CLI Client/1.0.0"})
-    page = urllib.request.urlopen(req)
-    if page.getcode() != 200:
-        sys.stderr.write(f"HTTP error {page.getcode()}\n")
+    from cache import make_key
+
+    extract_cache = get_extract_cache()
+    key = make_key("http", address, EXTRACTOR_VERSION)
+    entry = None
+    if extract_cache is not None:
+        entry = extract_cache.get(key)
+
+    if entry is not None:
+        result = get_fetcher().fetch(address, entry["etag"], entry["last_modified"])
+        if result.not_modified:
+            return entry["content"]
+    else:
+        result = get_fetcher().fetch(address)
+
+    if result.status != 200:
+        sys.stderr.write(f"HTTP error {result.status}\n")
         return None
-    return page.read().decode("utf-8")
+
+    if extract_cache is not None and (result.etag or result.last_modified):
+        extract_cache.put(
+            key,
+            {
+                "etag": result.etag,
+                "last_modified": result.last_modified,
+                "content": result.content,
+            },
+        )
+
+    return result.content
+
+
+def from_web_page(address) -> Optional[str]:
+    result = from_http(address)
+    if result is not None and ("<!DOCTYPE html" in result or "<html" in result):
+        result = from_html(result)
+    return result
 
 
 def from_youtube(path) -> Optional[str]:
+    import youtube
+    from googleapiclient.errors import HttpError
+
     api_key = os.getenv("YOUTUBE_API_KEY")
     if not api_key:
         sys.stderr.write("YOUTUBE_API_KEY not set\n")
@@ -105,39 +263,54 @@ def from_youtube(path) -> Optional[str]:
         return None
 
     try:
-        # Initialize the YouTube API client
-        youtube = build("youtube", "v3", developerKey=api_key)
+        # Metadata and transcript are fetched concurrently and cached per video
+        details, transcript_text = youtube.fetch_video(
+            api_key,
+            video_id,
+            get_extract_cache(),
+        )
+    except HttpError as e:
+        sys.stderr.write(f"Failed to query YouTube API: {e}\n")
+        return None
+    except Exception as e:
+        sys.stderr.write(f"Failed to get transcript: {e}\n")
+        return None
 
-        # Call the YouTube API to get the transcript
+    duration_minutes = round(details["duration"] / 60)
+    return f"{video_id}\n{duration_minutes}\n{transcript_text}"
 
-        # Get video details
-        video_response = (
-            youtube.videos().list(id=video_id, part="contentDetails,snippet").execute()
-        )
 
-        # Extract video duration and convert to minutes
-        duration_iso = video_response["items"][0]["contentDetails"]["duration"]
-        duration_seconds = isodate.parse_duration(duration_iso).total_seconds()
-        duration_minutes = round(duration_seconds / 60)
+def prefetch_youtube(sources: list[str]):
+    api_key = os.getenv("YOUTUBE_API_KEY")
+    video_ids = [get_video_id(source) for source in sources]
+    video_ids = [video_id for video_id in video_ids if video_id is not None]
+    if not api_key or len(video_ids) < 2:
+        return
 
-        # Get transcript
-        try:
-            transcript_list = YouTubeTranscriptApi.get_transcript(
-                video_id,
-                languages=["en", "de"],
-            )
-            transcript_text = " ".join([item["text"] for item in transcript_list])
-        except Exception as e:
-            sys.stderr.write(f"Failed to get transcript: {e}\n")
-            return None
+    import youtube
 
-        result = f"{video_id}\n{duration_minutes}\n{transcript_text}"
+    # One videos().list request covers up to 50 videos, the extractors then
+    # find the metadata already fetched
+    try:
+        youtube.fetch_metadata(api_key, video_ids, get_extract_cache())
+    except Exception as e:
+        sys.stderr.write(f"Failed to prefetch YouTube metadata: {e}\n")
 
-        return result
 
-    except HttpError as e:
-        sys.stderr.write(f"Failed to initialize YouTube API: {e}\n")
-        return None
+def expand_playlist(url: str) -> list[str]:
+    import youtube
+
+    playlist_id = youtube.get_playlist_id(url)
+    api_key = os.getenv("YOUTUBE_API_KEY")
+    if playlist_id is None or not api_key:
+        return [url]
+
+    try:
+        video_ids = youtube.list_playlist(api_key, playlist_id)
+    except Exception as e:
+        sys.stderr.write(f"Failed to list playlist '{playlist_id}': {e}\n")
+        return [url]
+    return [f"https://www.youtube.com/watch?v={video_id}" for video_id in video_ids]
 
 
 def from_audio(path) -> Optional[str]:
@@ -146,6 +319,38 @@ def from_audio(path) -> Optional[str]:
         sys.stderr.write(f"Failed to create OpenAI client: {error}\n")
         return None
 
+    model = os.getenv("AI_TRANSCRIPTION_MODEL", "whisper-1")
+
+    import audio
+
+    segment_format = os.getenv("AI_TRANSCRIPTION_FORMAT", "flac").lower()
+    if segment_format not in audio.SEGMENT_FORMATS:
+        sys.stderr.write(f"Unsupported transcription format: {segment_format}\n")
+        return None
+    segment_seconds = audio.get_float_env("AI_TRANSCRIPTION_SEGMENT", 600)
+    overlap_seconds = audio.get_float_env("AI_TRANSCRIPTION_OVERLAP", 5)
+    duration = None
+    if audio.can_segment(path):
+        duration = audio.get_duration(path)
+
+    if duration is not None and duration > segment_seconds:
+        try:
+            return audio.transcribe_segmented(
+                client,
+                model,
+                path,
+                duration,
+                segment_seconds,
+                overlap_seconds,
+                int(audio.get_float_env("AI_TRANSCRIPTION_JOBS", 4)),
+                get_extract_cache(),
+                hash_file(path),
+                segment_format,
+            )
+        except Exception as e:
+            sys.stderr.write(f"Failed to transcribe audio: {e}\n")
+            return None
+
     audio_file = None
     try:
         audio_file = open(path, "rb")
@@ -153,8 +358,6 @@ def from_audio(path) -> Optional[str]:
         sys.stderr.write(f"Failed to read audio file: {path}\n")
         return None
 
-    model = os.getenv("AI_TRANSCRIPTION_MODEL", "whisper-1")
-
     try:
         transcript = client.audio.transcriptions.create(
             model=model,
@@ -166,54 +369,398 @@ def from_audio(path) -> Optional[str]:
         return None
 
 
+def hash_file(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_extract_cache():
+    global extract_cache
+
+    if not cache_enabled:
+        return None
+
+    if extract_cache is None:
+        import cache
+
+        extract_cache = cache.open_cache("extract")
+
+    return extract_cache
+
+
+def get_cache_key(path: str, pages: Optional[str] = None) -> Optional[str]:
+    from cache import make_key
+
+    if get_video_id(path) is not None:
+        # Video metadata and transcripts are cached separately with a TTL
+        return None
+    if path.startswith("http://") or path.startswith("https://"):
+        # Web pages are revalidated with their HTTP validators in from_http
+        return None
+    if file_exists(path):
+        ext = os.path.splitext(path)[1].lower()
+        return make_key(
+            "file",
+            hash_file(path),
+            ext,
+            EXTRACTOR_VERSION,
+            pages,
+            main_content_only,
+        )
+    return None
+
+
+def is_url(path: str) -> bool:
+    return path.startswith("http://") or path.startswith("https://")
+
+
+def is_youtube(path: str) -> bool:
+    return get_video_id(path) is not None
+
+
+def has_extension(*extensions: str) -> Callable[[str], bool]:
+    def matches(path: str) -> bool:
+        if "://" in path:
+            return False
+        return os.path.splitext(path)[1].lower() in extensions
+
+    return matches
+
+
+def register_extractor(
+    name: str,
+    predicate: Callable[[str], bool],
+    function: Callable[[str], Optional[str]],
+    cpu_bound: bool = False,
+):
+    # Extractors registered later take precedence over the built-in ones
+    extractors.insert(0, (name, predicate, function, cpu_bound))
+
+
+def load_plugins():
+    global plugins_loaded
+
+    if plugins_loaded:
+        return
+    plugins_loaded = True
+
+    # Third-party extractors are modules listed in AI_EXTRACT_PLUGINS, each
+    # providing register(register_extractor)
+    for module_name in os.getenv("AI_EXTRACT_PLUGINS", "").split(","):
+        module_name = module_name.strip()
+        if module_name == "":
+            continue
+        try:
+            importlib.import_module(module_name).register(register_extractor)
+        except Exception as e:
+            sys.stderr.write(f"Failed to load extractor plugin {module_name}: {e}\n")
+
+
+def find_extractor(path: str) -> Optional[tuple]:
+    load_plugins()
+    for extractor in extractors:
+        if extractor[1](path):
+            return extractor
+    return None
+
+
+register_extractor(
+    "audio",
+    has_extension(
+        ".flac",
+        ".m4a",
+        ".mp3",
+        ".mp4",
+        ".mpeg",
+        ".mpga",
+        ".oga",
+        ".ogg",
+        ".wav",
+        ".webm",
+    ),
+    from_audio,
+)
+register_extractor("doc", has_extension(".doc"), from_doc)
+register_extractor("docx", has_extension(".docx"), from_docx, cpu_bound=True)
+register_extractor("pdf", has_extension(".pdf"), from_pdf, cpu_bound=True)
+register_extractor("html", has_extension(".html", ".htm"), from_html, cpu_bound=True)
+register_extractor(
+    "text",
+    has_extension(".txt", ".md", ".ini", ".csv", ".json", ".xml", ".yaml", ".yml"),
+    from_txt,
+)
+register_extractor("http", is_url, from_web_page)
+register_extractor("youtube", is_youtube, from_youtube)
+
+
+def extract_uncached(path) -> Optional[str]:
+    extractor = find_extractor(path)
+    if extractor is None:
+        sys.stderr.write(f"Unsupported file type '{path}'\n")
+        return None
+
+    name, _, function, _ = extractor
+    try:
+        return function(path)
+    except ImportError as e:
+        sys.stderr.write(f"The {name} extractor is not available: {e}\n")
+        return None
+
+
+def try_extract(path) -> Optional[str]:
+    extract_cache = get_extract_cache()
+    key = None
+    if extract_cache is not None:
+        key = get_cache_key(path)
+    if key is not None:
+        entry = extract_cache.get(key)
+        if entry is not None:
+            return entry["content"]
+
+    result = extract_uncached(path)
+
+    if key is not None and result is not None:
+        extract_cache.put(key, {"content": result})
+    return result
+
+
 def extract(path) -> Optional[str]:
     try:
-        ext = os.path.splitext(path)[1].lower()
-        if get_video_id(path) is not None:
-            return from_youtube(path)
-        elif path.startswith("http://") or path.startswith("https://"):
-            result = from_http(path)
-            if "<!DOCTYPE html" in result or "<html" in result:
-                result = from_html(result)
-            return result
-        if ext in [".txt", ".md", ".ini", ".csv", ".json", ".xml", ".yaml", ".yml"]:
-            return from_txt(path)
-        elif ext in [".html", ".htm"]:
-            return from_html(path)
-        elif ext in [".pdf"]:
-            return from_pdf(path)
-        elif ext in [".docx"]:
-            return from_docx(path)
-        elif ext in [".doc"]:
-            return from_doc(path)
-        elif ext in [
-            ".flac",
-            ".m4a",
-            ".mp3",
-            ".mp4",
-            ".mpeg",
-            ".mpga",
-            ".oga",
-            ".ogg",
-            ".wav",
-            ".webm",
-        ]:
-            return from_audio(path)
-        else:
-            sys.stderr.write(f"Unsupported file type '{path}'\n")
-            return None
+        return try_extract(path)
     except Exception as e:
         sys.stderr.write(f"Error: {e}\n")
         return None
 
 
-def main():
-    dotenv.load_dotenv(os.path.dirname(os.path.realpath(__file__)) + "/.env")
+def is_cpu_bound(path: str) -> bool:
+    extractor = find_extractor(path)
+    return extractor is not None and extractor[3]
+
 
-    if len(sys.argv) != 2:
-        sys.stderr.write(f"Usage: {sys.argv[0]} <path>\n")
+def extract_source(path: str) -> dict:
+    start = time.monotonic()
+    content, error = None, None
+    try:
+        content = try_extract(path)
+        if content is None:
+            error = "No content extracted"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        "source": path,
+        "content": content,
+        "error": error,
+        "duration": round(time.monotonic() - start, 3),
+    }
+
+
+def init_worker(use_cache: bool, timeout: float, max_bytes: int, main_content: bool):
+    global cache_enabled
+    global http_timeout
+    global http_max_bytes
+    global main_content_only
+    global pdf_workers
+
+    cache_enabled = use_cache
+    http_timeout = timeout
+    http_max_bytes = max_bytes
+    main_content_only = main_content
+    # Worker processes already run in parallel, do not nest process pools
+    pdf_workers = 1
+
+
+def expand_sources(paths: list[str], list_file: Optional[str]) -> list[str]:
+    sources = []
+    if list_file is not None:
+        f = sys.stdin if list_file == "-" else open(list_file, "r")
+        with f:
+            for line in f:
+                line = line.strip()
+                if line != "" and not line.startswith("#"):
+                    sources.append(line)
+
+    for path in paths:
+        if "://" not in path and glob.has_magic(path):
+            sources += sorted(glob.glob(path, recursive=True))
+        else:
+            sources.append(path)
+
+    expanded = []
+    for source in sources:
+        if "list=" in source and get_video_id(source) is None:
+            expanded += expand_playlist(source)
+        else:
+            expanded.append(source)
+    return expanded
+
+
+def extract_many(sources: list[str], jobs: int) -> Iterator[dict]:
+    prefetch_youtube(sources)
+
+    initargs = (cache_enabled, http_timeout, http_max_bytes, main_content_only)
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=initargs,
+    ) as processes, ThreadPoolExecutor(max_workers=jobs) as threads:
+        # Workers are forked on submit, CPU bound sources go first so no I/O
+        # thread can hold a lock, such as the cache's, that a worker inherits
+        futures = [
+            processes.submit(extract_source, source)
+            for source in sources
+            if is_cpu_bound(source)
+        ]
+        futures += [
+            threads.submit(extract_source, source)
+            for source in sources
+            if not is_cpu_bound(source)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def generate_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pages",
+        type=str,
+        help="Only extract these PDF pages, for example 1-5,8,10-",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="Number of processes used for PDF extraction",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=http_timeout,
+        help="Timeout in seconds for HTTP requests",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=http_max_bytes,
+        help="Maximum size of a downloaded web page",
+    )
+    parser.add_argument(
+        "--main-content",
+        action="store_true",
+        help="Only keep the main content of web pages, without navigation and footers",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the extraction cache",
+    )
+    parser.add_argument(
+        "-i",
+        "--input-list",
+        type=str,
+        help="Read additional sources from this file, one per line ('-' for stdin)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 4,
+        help="Number of sources extracted concurrently",
+    )
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Print one JSON record per source, implied for multiple sources",
+    )
+    parser.add_argument(
+        "path",
+        type=str,
+        nargs="*",
+        help="Files, globs or URLs to extract text from",
+    )
+
+    return parser
+
+
+def stream_pdf(path: str, pages: Optional[str], workers: Optional[int]) -> bool:
+    if not file_exists(path):
+        sys.stderr.write(f"File not found '{path}'\n")
+        return False
+
+    try:
+        extract_cache = get_extract_cache()
+        key = None
+        if extract_cache is not None:
+            key = get_cache_key(path, pages)
+            entry = extract_cache.get(key)
+            if entry is not None:
+                sys.stdout.write(entry["content"] + "\n")
+                return True
+
+        result = []
+        for index, page in enumerate(iter_pdf_pages(path, pages, workers)):
+            if index > 0:
+                sys.stdout.write(PAGE_SEPARATOR)
+            sys.stdout.write(page)
+            sys.stdout.flush()
+            result.append(page)
+    except Exception as e:
+        sys.stderr.write(f"Error: {e}\n")
+        return False
+
+    sys.stdout.write("\n")
+
+    if key is not None:
+        extract_cache.put(key, {"content": PAGE_SEPARATOR.join(result)})
+    return True
+
+
+def main():
+    env_file = os.path.dirname(os.path.realpath(__file__)) + "/.env"
+    if os.path.isfile(env_file):
+        import dotenv
+
+        dotenv.load_dotenv(env_file)
+
+    global cache_enabled
+    global http_timeout
+    global http_max_bytes
+    global main_content_only
+
+    args = generate_parser().parse_args()
+    cache_enabled = not args.no_cache
+    http_timeout = args.timeout
+    http_max_bytes = args.max_bytes
+    main_content_only = args.main_content
+
+    sources = expand_sources(args.path, args.input_list)
+    if len(sources) == 0:
+        sys.stderr.write("No sources given\n")
         exit(1)
-    path = sys.argv[1]
+
+    if len(sources) > 1 or args.jsonl:
+        failed = False
+        for record in extract_many(sources, max(1, args.jobs)):
+            failed = failed or record["error"] is not None
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+        if failed:
+            exit(1)
+        return
+
+    path = sources[0]
+
+    # PDFs are written page by page so a downstream reader can start early
+    extractor = find_extractor(path)
+    if extractor is not None and extractor[0] == "pdf":
+        if not stream_pdf(path, args.pages, args.workers):
+            exit(1)
+        return
+
     result = extract(path)
     if result is None:
         exit(1)
@@ -0,0 +1,111 @@
+import asyncio
+import contextvars
+import queue
+import threading
+from typing import Optional
+
+loop = None
+loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global loop
+
+    # One event loop thread serves every synchronous caller, so async clients
+    # and their connection pools live as long as the process
+    with loop_lock:
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever,
+                name="ai-cli-event-loop",
+                daemon=True,
+            ).start()
+        return loop
+
+
+async def with_context(context: contextvars.Context, coroutine):
+    # Tasks started from another thread do not inherit its context variables,
+    # such as the current metrics step
+    for variable, value in context.items():
+        variable.set(value)
+    return await coroutine
+
+
+def submit(coroutine):
+    return asyncio.run_coroutine_threadsafe(
+        with_context(contextvars.copy_context(), coroutine),
+        get_loop(),
+    )
+
+
+def run(coroutine):
+    future = submit(coroutine)
+    try:
+        return future.result()
+    except BaseException:
+        # Ctrl-C cancels the request, which closes its connection
+        future.cancel()
+        raise
+
+
+END = object()
+
+
+class SyncStream:
+    def __init__(self, completion):
+        self.completion = completion
+        self.chunks = queue.SimpleQueue()
+        self.future = None
+
+    async def pump(self):
+        from driver_openai import close_completion
+
+        try:
+            async for chunk in self.completion:
+                self.chunks.put((chunk, None))
+            self.chunks.put((END, None))
+        except Exception as e:
+            self.chunks.put((None, e))
+        finally:
+            await close_completion(self.completion)
+
+    def __iter__(self):
+        if self.future is None:
+            self.future = submit(self.pump())
+
+        while True:
+            chunk, error = self.chunks.get()
+            if error is not None:
+                raise error
+            if chunk is END:
+                return
+            yield chunk
+
+    def close(self):
+        from driver_openai import close_completion
+
+        if self.future is None:
+            run(close_completion(self.completion))
+        else:
+            # The pump closes the stream when it is cancelled
+            self.future.cancel()
+
+
+class SyncDriver:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def perform_request(
+        self,
+        history: list,
+        is_stream: bool,
+        temperature: float = 0.7,
+        model: Optional[str] = None,
+    ):
+        completion, error = run(
+            self.driver.perform_request(history, is_stream, temperature, model),
+        )
+        if error is None and is_stream:
+            completion = SyncStream(completion)
+        return completion, error
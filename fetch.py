@@ -0,0 +1,271 @@
+import base64
+import codecs
+import http.client
+import re
+import threading
+import urllib.parse
+import zlib
+from typing import Optional
+from typing import Tuple
+
+USER_AGENT = "AI-CLI Client/1.0.0"
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+MAX_REDIRECTS = 5
+READ_SIZE = 64 * 1024
+
+
+class FetchResult:
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        content: Optional[str] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        content_type: Optional[str] = None,
+    ):
+        self.url = url
+        self.status = status
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+
+def get_charset(content_type: Optional[str]) -> Optional[str]:
+    if content_type is None:
+        return None
+    match = re.search(r"charset=[\"']?([\w.:-]+)", content_type, re.IGNORECASE)
+    if match is None:
+        return None
+    try:
+        return codecs.lookup(match.group(1)).name
+    except LookupError:
+        return None
+
+
+def sniff_charset(head: bytes) -> Optional[str]:
+    # Look for <meta charset> in the first bytes of an HTML document
+    match = re.search(rb"<meta[^>]+charset=[\"']?([\w.:-]+)", head, re.IGNORECASE)
+    if match is None:
+        return None
+    try:
+        return codecs.lookup(match.group(1).decode("ascii")).name
+    except LookupError:
+        return None
+
+
+def get_decompressor(encoding: Optional[str]):
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "gzip" or encoding == "x-gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "identity":
+        return None
+    raise ValueError(f"Unsupported content encoding '{encoding}'")
+
+
+def get_proxy(scheme: str, host: str) -> Optional[urllib.parse.SplitResult]:
+    import urllib.request
+
+    # The same environment variables and bypass rules as urllib
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    return urllib.parse.urlsplit(proxy)
+
+
+def get_proxy_headers(proxy: urllib.parse.SplitResult) -> dict:
+    if proxy.username is None:
+        return {}
+    credentials = urllib.parse.unquote(proxy.username)
+    credentials += ":" + urllib.parse.unquote(proxy.password or "")
+    token = base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+    return {"Proxy-Authorization": "Basic " + token}
+
+
+def get_address(netloc: str) -> str:
+    # Credentials in the URL are not part of the host to connect to
+    return netloc.rsplit("@", 1)[-1]
+
+
+class HttpFetcher:
+    def __init__(
+        self,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        # http.client connections are not thread safe, keep one set per thread
+        self._local = threading.local()
+        self._proxies = {}
+
+    def _get_connections(self) -> dict:
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        return connections
+
+    def _get_proxy(self, key: Tuple[str, str]) -> Optional[urllib.parse.SplitResult]:
+        if key not in self._proxies:
+            scheme, address = key
+            host = urllib.parse.urlsplit("//" + address).hostname or address
+            self._proxies[key] = get_proxy(scheme, host)
+        return self._proxies[key]
+
+    def _get_connection(self, key: Tuple[str, str]):
+        connections = self._get_connections()
+        if key not in connections:
+            scheme, address = key
+            proxy = self._get_proxy(key)
+            if proxy is None:
+                host = address
+            else:
+                host = get_address(proxy.netloc)
+
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(host, timeout=self.timeout)
+                if proxy is not None:
+                    connection.set_tunnel(address, headers=get_proxy_headers(proxy))
+            else:
+                connection = http.client.HTTPConnection(host, timeout=self.timeout)
+            connections[key] = connection
+        return connections[key]
+
+    def _discard_connection(self, key: Tuple[str, str]):
+        connection = self._get_connections().pop(key, None)
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        for connection in self._get_connections().values():
+            connection.close()
+        self._local.connections = {}
+
+    def _request(self, url: str, headers: dict):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ["http", "https"]:
+            raise ValueError(f"Unsupported URL scheme '{parsed.scheme}'")
+
+        key = (parsed.scheme, get_address(parsed.netloc))
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+
+        proxy = self._get_proxy(key)
+        if proxy is not None and parsed.scheme == "http":
+            # Plain HTTP proxies take the absolute URL instead of a tunnel
+            target = "http://" + key[1] + target
+            headers = dict(headers, **get_proxy_headers(proxy))
+
+        try:
+            connection = self._get_connection(key)
+            connection.request("GET", target, headers=headers)
+            return connection.getresponse(), key
+        except (http.client.HTTPException, ConnectionError):
+            # A kept-alive connection may have been closed by the server,
+            # retry once on a fresh connection
+            self._discard_connection(key)
+            connection = self._get_connection(key)
+            connection.request("GET", target, headers=headers)
+            return connection.getresponse(), key
+
+    def fetch(
+        self,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> FetchResult:
+        headers = {
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": "gzip, deflate",
+        }
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        for _ in range(MAX_REDIRECTS + 1):
+            response, key = self._request(url, headers)
+
+            try:
+                if response.status in [301, 302, 303, 307, 308]:
+                    location = response.getheader("Location")
+                    response.read()
+                    if location is None:
+                        raise ValueError(f"Redirect without location for '{url}'")
+                    url = urllib.parse.urljoin(url, location)
+                    continue
+
+                result = FetchResult(
+                    url,
+                    response.status,
+                    etag=response.getheader("ETag"),
+                    last_modified=response.getheader("Last-Modified"),
+                    content_type=response.getheader("Content-Type"),
+                )
+
+                if response.status == 200:
+                    result.content = self._read_body(response, result.content_type)
+                else:
+                    response.read()
+            except Exception:
+                # The connection is in an unknown state after a failed read
+                self._discard_connection(key)
+                raise
+
+            if response.will_close:
+                self._discard_connection(key)
+            return result
+
+        raise ValueError(f"Too many redirects for '{url}'")
+
+    def _iter_body(self, response):
+        decompressor = get_decompressor(response.getheader("Content-Encoding"))
+        while True:
+            data = response.read(READ_SIZE)
+            if not data:
+                break
+            if decompressor is not None:
+                data = decompressor.decompress(data)
+            yield data
+        if decompressor is not None:
+            yield decompressor.flush()
+
+    def _read_body(self, response, content_type: Optional[str]) -> str:
+        length = response.getheader("Content-Length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            raise ValueError(f"Response exceeds the limit of {self.max_bytes} bytes")
+
+        charset = get_charset(content_type)
+        decoder = None
+        parts = []
+        size = 0
+
+        for data in self._iter_body(response):
+            # The limit applies to the decoded body to guard against
+            # compression bombs as well
+            size += len(data)
+            if size > self.max_bytes:
+                raise ValueError(
+                    f"Response exceeds the limit of {self.max_bytes} bytes",
+                )
+
+            if decoder is None:
+                charset = charset or sniff_charset(data[:4096]) or "utf-8"
+                decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+            parts.append(decoder.decode(data))
+
+        if decoder is not None:
+            parts.append(decoder.decode(b"", final=True))
+
+        return "".join(parts)
@@ -0,0 +1,272 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+collector = None
+current_step = contextvars.ContextVar("current_step", default=None)
+
+
+def get_percentile(values: list[float], percentile: float) -> Optional[float]:
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))]
+
+
+def get_usage(usage, name: str) -> Optional[int]:
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+class Step:
+    def __init__(self, name: str, model: Optional[str] = None):
+        self.name = name
+        self.model = model
+        self.start = time.perf_counter()
+        self.response_at = None
+        self.first_token_at = None
+        self.last_chunk_at = None
+        self.end = None
+        self.gaps = []
+        self.chunks = 0
+        self.attempts = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.usage_estimated = False
+
+    def record_attempt(self):
+        self.attempts += 1
+
+    def record_response(self):
+        # For streams the driver returns once the response headers arrived
+        self.response_at = time.perf_counter()
+
+    def record_chunk(self):
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        else:
+            self.gaps.append(now - self.last_chunk_at)
+        self.last_chunk_at = now
+        self.chunks += 1
+
+    def finish(self, usage=None, history: Optional[list] = None, result: str = ""):
+        self.end = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = self.end
+
+        self.prompt_tokens = get_usage(usage, "prompt_tokens")
+        self.completion_tokens = get_usage(usage, "completion_tokens")
+        if self.prompt_tokens is None or self.completion_tokens is None:
+            # Cached answers and servers without usage reporting
+            from ai import estimate_tokens
+
+            self.usage_estimated = True
+            self.prompt_tokens = sum(
+                estimate_tokens(message["content"]) for message in history or []
+            )
+            self.completion_tokens = estimate_tokens(result)
+
+    def to_dict(self) -> dict:
+        end = self.end or time.perf_counter()
+        # Without streaming the whole answer arrives at once
+        generation = end - self.start
+        if self.chunks > 1:
+            generation = end - self.first_token_at
+        tokens_per_second = None
+        if self.completion_tokens and generation > 0:
+            tokens_per_second = self.completion_tokens / generation
+
+        return {
+            "step": self.name,
+            "model": self.model,
+            "request_seconds": (
+                self.response_at - self.start if self.response_at else None
+            ),
+            "ttft_seconds": (
+                self.first_token_at - self.start if self.first_token_at else None
+            ),
+            "duration_seconds": end - self.start,
+            "chunks": self.chunks,
+            "chunk_gap_mean_seconds": (
+                sum(self.gaps) / len(self.gaps) if len(self.gaps) > 0 else None
+            ),
+            "chunk_gap_p95_seconds": get_percentile(self.gaps, 0.95),
+            "chunk_gap_max_seconds": max(self.gaps) if len(self.gaps) > 0 else None,
+            "attempts": self.attempts,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "usage_estimated": self.usage_estimated,
+            "tokens_per_second": tokens_per_second,
+        }
+
+
+class Collector:
+    def __init__(self):
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.phases = []
+        self.steps = []
+        self._lock = threading.Lock()
+
+    def add_phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases.append((name, seconds))
+
+    def start_step(self, name: str, model: Optional[str] = None) -> Step:
+        step = Step(name, model)
+        with self._lock:
+            self.steps.append(step)
+        current_step.set(step)
+        return step
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "timestamp": self.started,
+                "duration_seconds": time.perf_counter() - self.start,
+                "phases": [
+                    {"phase": name, "seconds": seconds} for name, seconds in self.phases
+                ],
+                "steps": [step.to_dict() for step in self.steps],
+            }
+
+    def format_summary(self) -> str:
+        data = self.to_dict()
+
+        def ms(value: Optional[float]) -> str:
+            return "-" if value is None else f"{value * 1000:.0f} ms"
+
+        lines = ["Stats:"]
+        for phase in data["phases"]:
+            lines.append(f"  {phase['phase']}: {ms(phase['seconds'])}")
+        for step in data["steps"]:
+            rate = "-"
+            if step["tokens_per_second"] is not None:
+                rate = f"{step['tokens_per_second']:.1f}"
+            estimated = " (estimated)" if step["usage_estimated"] else ""
+            lines.append(
+                f"  {step['step']}: ttft {ms(step['ttft_seconds'])}, "
+                f"total {ms(step['duration_seconds'])}, "
+                f"tokens {step['prompt_tokens']} in / "
+                f"{step['completion_tokens']} out{estimated}, "
+                f"{rate} tokens/s, "
+                f"max gap {ms(step['chunk_gap_max_seconds'])}",
+            )
+        lines.append(f"  total: {ms(data['duration_seconds'])}")
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        data = self.to_dict()
+        series = {
+            "ai_cli_run_timestamp_seconds": ("gauge", [("", data["timestamp"])]),
+            "ai_cli_run_duration_seconds": (
+                "gauge",
+                [("", data["duration_seconds"])],
+            ),
+            "ai_cli_phase_seconds": (
+                "gauge",
+                [
+                    (f'phase="{escape_label(phase["phase"])}"', phase["seconds"])
+                    for phase in data["phases"]
+                ],
+            ),
+        }
+
+        step_metrics = [
+            ("request_seconds", "ai_cli_step_request_seconds"),
+            ("ttft_seconds", "ai_cli_step_ttft_seconds"),
+            ("duration_seconds", "ai_cli_step_duration_seconds"),
+            ("chunk_gap_mean_seconds", "ai_cli_step_chunk_gap_mean_seconds"),
+            ("chunk_gap_max_seconds", "ai_cli_step_chunk_gap_max_seconds"),
+            ("attempts", "ai_cli_step_attempts"),
+            ("prompt_tokens", "ai_cli_step_prompt_tokens"),
+            ("completion_tokens", "ai_cli_step_completion_tokens"),
+            ("tokens_per_second", "ai_cli_step_tokens_per_second"),
+        ]
+        for field, name in step_metrics:
+            samples = []
+            for index, step in enumerate(data["steps"]):
+                if step[field] is None:
+                    continue
+                labels = (
+                    f'index="{index}",step="{escape_label(step["step"])}",'
+                    f'model="{escape_label(step["model"] or "")}"'
+                )
+                samples.append((labels, step[field]))
+            series[name] = ("gauge", samples)
+
+        lines = []
+        for name, (kind, samples) in series.items():
+            if len(samples) == 0:
+                continue
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if labels:
+                    lines.append(f"{name}{{{labels}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def enable() -> Collector:
+    global collector
+
+    if collector is None:
+        collector = Collector()
+    return collector
+
+
+def is_enabled() -> bool:
+    return collector is not None
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if collector is not None:
+            collector.add_phase(name, time.perf_counter() - start)
+
+
+def start_step(name: str, model: Optional[str] = None) -> Optional[Step]:
+    if collector is None:
+        return None
+    return collector.start_step(name, model)
+
+
+def get_current_step() -> Optional[Step]:
+    if collector is None:
+        return None
+    return current_step.get()
+
+
+def write_report(path: str):
+    if collector is None:
+        return
+
+    if path.endswith(".prom"):
+        content = collector.to_prometheus()
+    else:
+        content = json.dumps(collector.to_dict(), indent=2) + "\n"
+
+    # Written atomically, a textfile collector must never see a partial file
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
@@ -1,30 +1,193 @@
+import importlib
 import json
 import os
+import re
+import threading
 from typing import Any
 from typing import Optional
 
-from driver_openai import OpenAIDriver
-
+# Driver modules are only imported once a request is about to be made.
+# Drivers are asynchronous, synchronous callers go through the facade.
+drivers = {
+    "openai": ("driver_openai", "OpenAIDriver"),
+}
 providers = {}
 completion_models = {}
+# A token in this form names the environment variable that holds it
+TOKEN_VARIABLE = re.compile(r"[A-Z][A-Z0-9_]*")
+clients = {}
+clients_lock = threading.Lock()
+
+
+def register_driver(
+    name: str,
+    module_name: str,
+    driver_class: str,
+):
+    drivers[name] = (module_name, driver_class)
+
+
+def load_driver_module(name: str) -> (Any, str):
+    if name not in drivers:
+        return None, "Unknown driver " + name
+
+    try:
+        return importlib.import_module(drivers[name][0]), None
+    except ImportError as e:
+        return None, f"Failed to load driver {name}: {e}"
 
 
 class Provider:
-    def __init__(self, driver_name, base_address, token):
+    def __init__(
+        self,
+        driver_name,
+        base_address,
+        token,
+        timeout: Optional[float] = None,
+        max_connections: Optional[int] = None,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        token_error: Optional[str] = None,
+    ):
         self.driver_name = driver_name
         self.base_address = base_address
         self.token = token
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.token_error = token_error
+        self._limiter = None
+        self._limiter_lock = threading.Lock()
+
+    def get_limiter(self):
+        if self.requests_per_minute is None and self.tokens_per_minute is None:
+            return None
+
+        # Shared by every driver of this provider so concurrent requests
+        # draw from the same quota
+        with self._limiter_lock:
+            if self._limiter is None:
+                from ratelimit import RateLimiter
+
+                self._limiter = RateLimiter(
+                    self.requests_per_minute,
+                    self.tokens_per_minute,
+                )
+            return self._limiter
+
+    def get_retry_policy(self):
+        from ratelimit import RetryPolicy
+
+        if self.max_retries is None:
+            return RetryPolicy()
+        return RetryPolicy(self.max_retries)
+
+    def get_client(self) -> (Any, str):
+        return get_client(self)
 
     def get_driver(self) -> (Any, str):
-        if self.driver_name == "openai":
-            return OpenAIDriver(self.base_address, self.token), None
-        return None, "Unknown driver " + self.driver_name
+        from facade import SyncDriver
+
+        driver, error = self.get_async_driver(shared=True)
+        if error is not None:
+            return None, error
+        return SyncDriver(driver), None
+
+    def get_async_driver(
+        self,
+        shared: bool = False,
+        retry_policy=None,
+    ) -> (Any, str):
+        if self.token_error is not None:
+            return None, self.token_error
+
+        module, error = load_driver_module(self.driver_name)
+        if error is not None:
+            return None, error
+
+        # Async clients are bound to the event loop they are first used on.
+        # Only the sync facade's loop lives as long as the process, so only
+        # its clients are shared through the registry. Other drivers have to
+        # be closed before their loop ends.
+        if shared:
+            client, error = get_client(self, is_async=True)
+        else:
+            client, error = module.create_client(
+                self.base_address,
+                self.token,
+                self.timeout,
+                self.max_connections,
+                is_async=True,
+            )
+        if error is not None:
+            return None, error
+
+        return (
+            getattr(module, drivers[self.driver_name][1])(
+                client,
+                self.get_limiter(),
+                retry_policy or self.get_retry_policy(),
+            ),
+            None,
+        )
 
 
 class CompletionModel:
-    def __init__(self, model_name: str, provider_name: str):
+    def __init__(
+        self,
+        model_name: str,
+        provider_name: str,
+        context_window: Optional[int] = None,
+        max_output_tokens: Optional[int] = None,
+        backends: Optional[list] = None,
+        hedge_after: Optional[float] = None,
+    ):
         self.model_name = model_name
         self.provider_name = provider_name
+        self.context_window = context_window
+        self.max_output_tokens = max_output_tokens
+        # (model_name, provider_name) pairs serving the same model
+        self.backends = backends or [(model_name, provider_name)]
+        self.hedge_after = hedge_after
+
+
+def get_client(provider: Provider, is_async: bool = False) -> (Any, str):
+    if provider.token_error is not None:
+        return None, provider.token_error
+
+    key = (
+        provider.driver_name,
+        provider.base_address,
+        provider.token,
+        provider.timeout,
+        provider.max_connections,
+        is_async,
+    )
+
+    with clients_lock:
+        if key in clients:
+            return clients[key], None
+
+        module, error = load_driver_module(provider.driver_name)
+        if error is not None:
+            return None, error
+
+        options = {"is_async": True} if is_async else {}
+        client, error = module.create_client(
+            provider.base_address,
+            provider.token,
+            provider.timeout,
+            provider.max_connections,
+            **options,
+        )
+
+        if error is None:
+            clients[key] = client
+
+        return client, error
 
 
 def reset():
@@ -35,6 +198,55 @@ def reset():
     completion_models = {}
 
 
+def get_models_files() -> list[str]:
+    global_models_file = (
+        os.path.dirname(
+            os.path.realpath(__file__),
+        )
+        + "/models.json"
+    )
+
+    user_config_path = None
+
+    if os.getenv("XDG_CONFIG_HOME") is not None:
+        user_config_path = os.getenv("XDG_CONFIG_HOME", "") + "/ai-cli"
+    elif os.getenv("HOME"):
+        user_config_path = os.getenv("HOME", "") + "/.config/ai-cli"
+    elif os.getenv("LOCALAPPDATA"):
+        user_config_path = os.getenv("LOCALAPPDATA", "") + "/ai-cli"
+
+    files = [global_models_file]
+    if user_config_path is not None:
+        files.append(user_config_path + "/models.json")
+    return [path for path in files if os.path.isfile(path)]
+
+
+def get_token_variables(files: list[str]) -> list[str]:
+    variables = []
+    for path in files:
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for provider_data in data.get("providers", {}).values():
+            token = provider_data.get("token", "")
+            if TOKEN_VARIABLE.fullmatch(token):
+                variables.append(token)
+    return variables
+
+
+def get_token(provider_name: str, token: str) -> (Optional[str], str):
+    if not TOKEN_VARIABLE.fullmatch(token):
+        return token, None
+    if not os.getenv(token):
+        return (
+            None,
+            f"Environment variable {token} for provider {provider_name} is not set",
+        )
+    return os.getenv(token), None
+
+
 def load_models_file(path: str):
     global providers
     global completion_models
@@ -43,16 +255,44 @@ def load_models_file(path: str):
         data = json.load(f)
 
     for provider_name, provider_data in data["providers"].items():
+        token, token_error = get_token(provider_name, provider_data["token"])
         providers[provider_name] = Provider(
             provider_data["driver"],
             provider_data["base_address"],
-            os.getenv(provider_data["token"]) or provider_data["token"],
+            token,
+            provider_data.get("timeout"),
+            provider_data.get("max_connections"),
+            provider_data.get("requests_per_minute"),
+            provider_data.get("tokens_per_minute"),
+            provider_data.get("max_retries"),
+            token_error,
         )
 
     for model_name, model_data in data["completion"].items():
+        backends = None
+        if "backends" in model_data:
+            # Backends without a model name serve the model's own, or else
+            # the first one a backend names
+            default_name = model_data.get("model_name") or next(
+                (
+                    backend["model_name"]
+                    for backend in model_data["backends"]
+                    if backend.get("model_name")
+                ),
+                None,
+            )
+            backends = [
+                (backend.get("model_name") or default_name, backend["provider"])
+                for backend in model_data["backends"]
+            ]
+
         completion_models[model_name] = CompletionModel(
-            model_data["model_name"],
-            model_data["provider"],
+            model_data.get("model_name") or backends[0][0],
+            model_data.get("provider") or backends[0][1],
+            model_data.get("context_window"),
+            model_data.get("max_output_tokens"),
+            backends,
+            model_data.get("hedge_after"),
         )
 
 
@@ -72,3 +312,24 @@ def get_completion_model_and_provider(name: str) -> (
     provider = providers[model.provider_name]
 
     return model, provider, None
+
+
+def get_completion_model_backends(name: str) -> (
+    Optional[CompletionModel],
+    Optional[list],
+    str,
+):
+    if name not in completion_models:
+        return None, None, "Invalid model " + str(name)
+
+    model = completion_models[name]
+
+    backends = []
+    for model_name, provider_name in model.backends:
+        if model_name is None:
+            return None, None, f"Model {name} has no model_name"
+        if provider_name not in providers:
+            return None, None, "Invalid provider " + provider_name
+        backends.append((model_name, provider_name, providers[provider_name]))
+
+    return model, backends, None
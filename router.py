@@ -0,0 +1,300 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any
+from typing import Optional
+from typing import Tuple
+
+EWMA_ALPHA = 0.3
+ERROR_PENALTY = 4.0
+MAX_CONSECUTIVE_FAILURES = 3
+COOLDOWN = 30.0
+# Assumed time to first token of a backend that has only ever failed
+UNMEASURED_TTFT = 10.0
+# Another backend is usually a better bet than waiting for a failing one
+ROUTED_MAX_RETRIES = 1
+ROUTED_MAX_DELAY = 2.0
+
+stats = {}
+stats_lock = threading.Lock()
+stats_path = None
+
+
+class BackendStats:
+    def __init__(
+        self,
+        ttft: Optional[float] = None,
+        error_rate: float = 0.0,
+        failures: int = 0,
+        failed_at: float = 0.0,
+    ):
+        self.ttft = ttft
+        self.error_rate = error_rate
+        self.failures = failures
+        # Wall clock time, so the cooldown carries over to the next run
+        self.failed_at = failed_at
+        self._lock = threading.Lock()
+
+    def record_success(self, ttft: float):
+        with self._lock:
+            if self.ttft is None:
+                self.ttft = ttft
+            else:
+                self.ttft += EWMA_ALPHA * (ttft - self.ttft)
+            self.error_rate -= EWMA_ALPHA * self.error_rate
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.error_rate += EWMA_ALPHA * (1.0 - self.error_rate)
+            self.failures += 1
+            self.failed_at = time.time()
+
+    def record_cancelled(self, elapsed: float):
+        # A hedge that lost took at least this long, which is only a lower
+        # bound on its time to first token
+        with self._lock:
+            if self.ttft is None:
+                self.ttft = elapsed
+            elif elapsed > self.ttft:
+                self.ttft += EWMA_ALPHA * (elapsed - self.ttft)
+
+    def score(self) -> Tuple[bool, float]:
+        with self._lock:
+            # A backend that keeps failing is only tried after the others
+            # until its cooldown has passed
+            cooling_down = (
+                self.failures >= MAX_CONSECUTIVE_FAILURES
+                and time.time() - self.failed_at < COOLDOWN
+            )
+            # Backends without measurements are tried first to learn about
+            # them, unless all they ever did was fail
+            ttft = self.ttft
+            if ttft is None:
+                ttft = UNMEASURED_TTFT if self.error_rate > 0 else 0.0
+            return cooling_down, ttft * (1.0 + ERROR_PENALTY * self.error_rate)
+
+
+def get_stats(key: str) -> BackendStats:
+    with stats_lock:
+        if key not in stats:
+            stats[key] = BackendStats()
+        return stats[key]
+
+
+def load_stats(path: str):
+    global stats_path
+
+    with stats_lock:
+        if stats_path is not None:
+            return
+        stats_path = path
+
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        for key, entry in data.items():
+            if key not in stats:
+                stats[key] = BackendStats(
+                    entry.get("ttft"),
+                    entry.get("error_rate", 0),
+                    entry.get("failures", 0),
+                    entry.get("failed_at", 0.0),
+                )
+
+    atexit.register(save_stats)
+
+
+def save_stats():
+    with stats_lock:
+        if stats_path is None:
+            return
+        data = {
+            key: {
+                "ttft": entry.ttft,
+                "error_rate": entry.error_rate,
+                "failures": entry.failures,
+                "failed_at": entry.failed_at,
+            }
+            for key, entry in stats.items()
+        }
+
+    try:
+        os.makedirs(os.path.dirname(stats_path), exist_ok=True)
+        tmp_path = f"{stats_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, stats_path)
+    except OSError:
+        pass
+
+
+class Backend:
+    def __init__(self, name: str, driver, model_name: str):
+        self.name = name
+        self.driver = driver
+        self.model_name = model_name
+        self.stats = get_stats(name)
+
+
+def order_backends(backends: list) -> list:
+    return sorted(backends, key=lambda backend: backend.stats.score())
+
+
+class PrefetchedStream:
+    def __init__(self, completion, iterator, first):
+        self.completion = completion
+        self.iterator = iterator
+        self.first = first
+
+    async def __aiter__(self):
+        if self.first is not None:
+            yield self.first
+        async for chunk in self.iterator:
+            yield chunk
+
+    async def close(self):
+        from driver_openai import close_completion
+
+        await close_completion(self.completion)
+
+
+async def prefetch_stream(completion) -> PrefetchedStream:
+    from driver_openai import close_completion
+
+    iterator = completion.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        # Cancelled hedges end up here as well
+        await close_completion(completion)
+        raise
+    return PrefetchedStream(completion, iterator, first)
+
+
+class RouterDriver:
+    def __init__(self, backends: list, hedge_after: Optional[float] = None):
+        self.backends = backends
+        self.hedge_after = hedge_after
+
+    async def close(self):
+        for backend in self.backends:
+            await backend.driver.close()
+
+    async def attempt(self, backend: Backend, history, is_stream, temperature):
+        start = time.monotonic()
+        try:
+            completion, error = await backend.driver.perform_request(
+                history,
+                is_stream,
+                temperature,
+                backend.model_name,
+            )
+            if error is None and is_stream:
+                completion = await prefetch_stream(completion)
+        except asyncio.CancelledError:
+            backend.stats.record_cancelled(time.monotonic() - start)
+            raise
+        except Exception as e:
+            completion, error = None, f"{type(e).__name__}: {e}"
+
+        if error is not None:
+            backend.stats.record_failure()
+            return None, error
+
+        backend.stats.record_success(time.monotonic() - start)
+        return completion, None
+
+    async def perform_request(
+        self,
+        history: list,
+        is_stream: bool,
+        temperature: float = 0.7,
+        model: Optional[str] = None,
+    ):
+        from driver_openai import close_completion
+
+        backends = order_backends(self.backends)
+        errors = []
+        tasks = {}
+        next_backend = 0
+        start_next = True
+        try:
+            while True:
+                if start_next and next_backend < len(backends):
+                    backend = backends[next_backend]
+                    task = asyncio.create_task(
+                        self.attempt(backend, history, is_stream, temperature),
+                    )
+                    tasks[task] = backend
+                    next_backend += 1
+                start_next = False
+
+                if len(tasks) == 0:
+                    return None, "All backends failed: " + "; ".join(errors)
+
+                # Without hedging the next backend is only tried on failure
+                timeout = None
+                if self.hedge_after is not None and next_backend < len(backends):
+                    timeout = self.hedge_after
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                start_next = True
+                for task in done:
+                    backend = tasks.pop(task)
+                    completion, error = task.result()
+                    if error is None:
+                        return completion, None
+                    errors.append(f"{backend.name}: {error}")
+        finally:
+            # Hedges that lost are cancelled, answers that came in too late
+            # are closed
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                try:
+                    completion, error = await task
+                except asyncio.CancelledError:
+                    continue
+                if completion is not None:
+                    await close_completion(completion)
+
+
+def create_driver(
+    backends: list,
+    hedge_after: Optional[float] = None,
+    shared: bool = False,
+) -> Tuple[Any, Optional[str]]:
+    import ai
+    from ratelimit import RetryPolicy
+
+    cache_dir = ai.get_cache_dir()
+    if cache_dir is not None:
+        load_stats(cache_dir + "/router-stats.json")
+
+    routed = []
+    for model_name, provider_name, provider in backends:
+        policy = provider.get_retry_policy()
+        policy = RetryPolicy(
+            min(policy.max_retries, ROUTED_MAX_RETRIES),
+            policy.base_delay,
+            ROUTED_MAX_DELAY,
+        )
+        driver, error = provider.get_async_driver(shared, policy)
+        if error is not None:
+            return None, error
+        routed.append(Backend(provider_name + "/" + model_name, driver, model_name))
+
+    return RouterDriver(routed, hedge_after), None
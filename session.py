@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from typing import Optional
+from typing import Tuple
+
+FSYNC_POLICIES = ["never", "message", "always"]
+MAX_BUFFER_SIZE = 4096
+MAX_BUFFER_AGE = 1.0
+
+ROLES = {
+    "System": "system",
+    "User": "user",
+    "Assistant": "assistant",
+}
+
+
+class SessionJournal:
+    def __init__(
+        self,
+        path: str,
+        fsync: str = "message",
+        max_buffer_size: int = MAX_BUFFER_SIZE,
+        max_buffer_age: float = MAX_BUFFER_AGE,
+    ):
+        self.path = path
+        self.fsync = fsync
+        self.max_buffer_size = max_buffer_size
+        self.max_buffer_age = max_buffer_age
+        self._file = None
+        self._lock = threading.Lock()
+        self._type = None
+        self._parts = []
+        self._size = 0
+        self._since = 0.0
+
+    def append(self, type_name: str, content: str):
+        if len(content) == 0:
+            return
+
+        with self._lock:
+            if self._type is not None and self._type != type_name:
+                # A different type means the previous message is complete
+                self._write_pending(self.fsync != "never")
+
+            if len(self._parts) == 0:
+                self._since = time.monotonic()
+            self._type = type_name
+            self._parts.append(content)
+            self._size += len(content)
+
+            if (
+                self._size >= self.max_buffer_size
+                or time.monotonic() - self._since >= self.max_buffer_age
+            ):
+                self._write_pending(self.fsync == "always")
+
+    def flush(self):
+        with self._lock:
+            self._write_pending(self.fsync != "never")
+
+    def close(self):
+        with self._lock:
+            self._write_pending(self.fsync != "never")
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write_pending(self, sync: bool):
+        if len(self._parts) == 0:
+            return
+
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # A resumed session has to end in a complete line before records
+            # are appended to it
+            if os.path.isfile(self.path):
+                repair_session(self.path)
+            self._file = open(self.path, "a")
+
+        record = {"type": self._type, "content": "".join(self._parts)}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+        self._parts = []
+        self._size = 0
+
+
+def repair_session(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # Sessions written before the journal was introduced are converted to
+    # one record per line
+    if data.lstrip().startswith(b"["):
+        try:
+            records = json.loads(data)
+        except ValueError:
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        return
+
+    end = data.rfind(b"\n") + 1
+    if end == len(data):
+        return
+
+    # A record written up to its newline is kept, a cut off one is dropped
+    with open(path, "r+b") as f:
+        try:
+            json.loads(data[end:])
+            f.seek(0, os.SEEK_END)
+            f.write(b"\n")
+        except ValueError:
+            f.truncate(end)
+
+
+def find_session(name: str, directory: Optional[str]) -> Optional[str]:
+    # Absolute, so the journal is appended to the file that was read
+    if os.path.isfile(name):
+        return os.path.abspath(name)
+
+    if directory is None:
+        return None
+
+    for candidate in [name, name + ".jsonl", name + ".json"]:
+        path = directory + "/" + candidate
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+
+def read_records(path: str) -> list:
+    with open(path, "r") as f:
+        data = f.read()
+
+    # Sessions written before the journal was introduced are a single JSON list
+    if data.lstrip().startswith("["):
+        return json.loads(data)
+
+    records = []
+    for line in data.splitlines():
+        if line.strip() == "":
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # The last line may be incomplete if the process was killed
+            break
+    return records
+
+
+def load_history(path: str) -> Tuple[Optional[list], Optional[str]]:
+    try:
+        records = read_records(path)
+    except (OSError, ValueError) as e:
+        return None, f"Failed to read session '{path}': {e}"
+
+    roles = []
+    contents = []
+    for record in records:
+        role = ROLES.get(record.get("type"))
+        if role is None:
+            continue
+        if len(roles) > 0 and roles[-1] == role:
+            contents[-1].append(record["content"])
+        else:
+            roles.append(role)
+            contents.append([record["content"]])
+
+    history = [
+        {"role": role, "content": "".join(parts)}
+        for role, parts in zip(roles, contents)
+    ]
+    return history, None
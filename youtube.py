@@ -0,0 +1,164 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+METADATA_TTL = 24 * 60 * 60
+TRANSCRIPT_TTL = 30 * 24 * 60 * 60
+MAX_IDS_PER_REQUEST = 50
+LANGUAGES = ["en", "de"]
+
+PLAYLIST_PATTERN = re.compile(
+    r"(?:https?:\/\/)?(?:www\.|m\.)?youtube\.com\/playlist\?(?:\S*&)?list=([a-zA-Z0-9_-]+)",
+)
+
+clients = {}
+clients_lock = threading.Lock()
+# Metadata fetched in a batch ahead of time, also used when there is no disk cache
+metadata = {}
+metadata_lock = threading.Lock()
+
+
+def get_playlist_id(url: str) -> Optional[str]:
+    match = PLAYLIST_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def get_client(api_key: str):
+    with clients_lock:
+        if api_key not in clients:
+            from googleapiclient.discovery import build
+
+            # The discovery document ships with the library, building the
+            # client does not need a request and the client is reused
+            clients[api_key] = build(
+                "youtube",
+                "v3",
+                developerKey=api_key,
+                static_discovery=True,
+                cache_discovery=False,
+            )
+        return clients[api_key]
+
+
+def get_cached(cache, key: str, ttl: float) -> Optional[dict]:
+    if cache is None:
+        return None
+    entry = cache.get(key)
+    if entry is None or time.time() - entry["fetched"] > ttl:
+        return None
+    return entry
+
+
+def put_cached(cache, key: str, entry: dict):
+    if cache is not None:
+        cache.put(key, dict(entry, fetched=time.time()))
+
+
+def get_metadata_key(video_id: str) -> str:
+    from cache import make_key
+
+    return make_key("youtube-metadata", video_id)
+
+
+def get_transcript_key(video_id: str) -> str:
+    from cache import make_key
+
+    return make_key("youtube-transcript", video_id, LANGUAGES)
+
+
+def fetch_metadata(api_key: str, video_ids: list[str], cache=None) -> dict:
+    import isodate
+
+    result = {}
+    missing = []
+    for video_id in dict.fromkeys(video_ids):
+        with metadata_lock:
+            entry = metadata.get(video_id)
+        if entry is None:
+            entry = get_cached(cache, get_metadata_key(video_id), METADATA_TTL)
+        if entry is None:
+            missing.append(video_id)
+        else:
+            result[video_id] = entry
+
+    if len(missing) > 0:
+        youtube = get_client(api_key)
+    for index in range(0, len(missing), MAX_IDS_PER_REQUEST):
+        batch = missing[index : index + MAX_IDS_PER_REQUEST]
+        response = (
+            youtube.videos()
+            .list(id=",".join(batch), part="contentDetails,snippet")
+            .execute()
+        )
+        for item in response.get("items", []):
+            duration = item["contentDetails"]["duration"]
+            entry = {
+                "title": item["snippet"]["title"],
+                "duration": isodate.parse_duration(duration).total_seconds(),
+            }
+            put_cached(cache, get_metadata_key(item["id"]), entry)
+            result[item["id"]] = entry
+
+    with metadata_lock:
+        metadata.update(result)
+    return result
+
+
+def fetch_transcript(video_id: str, cache=None) -> str:
+    key = get_transcript_key(video_id)
+    entry = get_cached(cache, key, TRANSCRIPT_TTL)
+    if entry is not None:
+        return entry["content"]
+
+    from youtube_transcript_api import YouTubeTranscriptApi
+
+    # get_transcript was replaced by an instance method in version 1.0
+    if hasattr(YouTubeTranscriptApi, "get_transcript"):
+        items = YouTubeTranscriptApi.get_transcript(video_id, languages=LANGUAGES)
+    else:
+        items = (
+            YouTubeTranscriptApi().fetch(video_id, languages=LANGUAGES).to_raw_data()
+        )
+
+    content = " ".join([item["text"] for item in items])
+    put_cached(cache, key, {"content": content})
+    return content
+
+
+def fetch_video(api_key: str, video_id: str, cache=None) -> tuple[dict, str]:
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        details = executor.submit(fetch_metadata, api_key, [video_id], cache)
+        transcript = executor.submit(fetch_transcript, video_id, cache)
+        # Wait for both so a failure of one does not leave the other running
+        transcript_error = transcript.exception()
+        found = details.result()
+        if transcript_error is not None:
+            raise transcript_error
+
+    if video_id not in found:
+        raise ValueError(f"Video '{video_id}' not found")
+    return found[video_id], transcript.result()
+
+
+def list_playlist(api_key: str, playlist_id: str) -> list[str]:
+    youtube = get_client(api_key)
+    video_ids = []
+    page_token = None
+    while True:
+        response = (
+            youtube.playlistItems()
+            .list(
+                playlistId=playlist_id,
+                part="contentDetails",
+                maxResults=MAX_IDS_PER_REQUEST,
+                pageToken=page_token,
+            )
+            .execute()
+        )
+        for item in response.get("items", []):
+            video_ids.append(item["contentDetails"]["videoId"])
+        page_token = response.get("nextPageToken")
+        if page_token is None:
+            return video_ids